@@ -1,26 +1,51 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import asyncio
+import os
+import pickle
+import sqlite3
+import sys
+import time
+from collections import OrderedDict, namedtuple
+from contextvars import ContextVar
 from functools import update_wrapper
+from inspect import iscoroutinefunction
+from threading import Event, Lock, Thread, get_ident, local
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses evictions maxsize currsize')
 
 
 def decorator(dec):
     '''
     Decorate a decorator so that it inherits the docstrings
-    and stuff from the function it's decorating.
+    and stuff from the function it's decorating. A coroutine
+    function stays a coroutine function after decoration.
     '''
     def wrap_dec(dec_func):
         decorated = dec(dec_func)
 
-        def wrap_func(*args, **kwargs):
-            result = decorated(*args, **kwargs)
+        def update():
             wrap_func.__dict__.update(decorated.__dict__)
             wrap_func.__dict__.update(dec.__dict__)
             wrap_func.__dict__.update(dec_func.__dict__)
-            return result
+
+        if iscoroutinefunction(decorated):
+            async def wrap_func(*args, **kwargs):
+                result = await decorated(*args, **kwargs)
+                update()
+                return result
+        else:
+            def wrap_func(*args, **kwargs):
+                result = decorated(*args, **kwargs)
+                update()
+                return result
 
         wrap_func.__doc__ = dec_func.__doc__
         wrap_func.__name__ = dec_func.__name__
+        wrap_func.__qualname__ = getattr(dec_func, '__qualname__', dec_func.__name__)
+        wrap_func.__module__ = dec_func.__module__
+        wrap_func.__dict__.update(decorated.__dict__)
         return wrap_func
 
     return wrap_dec
@@ -43,30 +68,340 @@ def disable(func):
 @decorator
 def countcalls(func):
     '''Decorator that counts calls made to the function decorated.'''
-    def wrapper(*args, **kwargs):
-        wrapper.calls += 1
-        return func(*args, **kwargs)
+    if iscoroutinefunction(func):
+        async def wrapper(*args, **kwargs):
+            wrapper.calls += 1
+            return await func(*args, **kwargs)
+    else:
+        def wrapper(*args, **kwargs):
+            wrapper.calls += 1
+            return func(*args, **kwargs)
     wrapper.calls = 0
 
     return wrapper
 
 
-@decorator
-def memo(func):
+def _make_key(args, kwargs, kwd_mark=(object(),)):
+    '''Build a hashable cache key from positional and keyword arguments.'''
+    key = tuple(args)
+    if kwargs:
+        key += kwd_mark + tuple(sorted(kwargs.items()))
+    return key
+
+
+def _pickle_key(key):
+    '''Default key serializer of SqliteCache.'''
+    return pickle.dumps(key, protocol=4)
+
+
+class SqliteCache(object):
+    '''
+    Persistent memo backend kept in an sqlite file, shared by all
+    threads and processes that open the same path:
+
+    @memo(backend=SqliteCache('/var/tmp/memo.db', maxsize=100000))
+    def f(x): ...
+
+    Keys are (module, qualified name, args, sorted kwargs) tuples turned
+    into bytes or str by serialize_key, pickle by default; values are
+    stored with dumps and read back with loads. Arguments whose pickle
+    is not stable between processes (sets of strings, objects without
+    value equality) need a serialize_key of their own. maxsize bounds
+    the number of rows, the least recently used ones are deleted first;
+    ttl is the number of seconds a row stays valid. The file uses WAL
+    journaling and each process and thread opens its own connection.
+    get() only reads: the hits it sees are remembered in memory and
+    their recency is written with the next set(), or in a transaction
+    of its own once touch_batch hits pile up, so with a busy writer
+    recency lags a little behind the actual use. close(), or leaving
+    a with block, closes the connections of all threads; the cache
+    reopens them if it is used again.
+    '''
+
+    def __init__(self, path, maxsize=None, ttl=None, serialize_key=_pickle_key,
+                 dumps=pickle.dumps, loads=pickle.loads, timeout=30, touch_batch=100):
+        if maxsize is not None and maxsize < 1:
+            raise ValueError('maxsize must be positive or None')
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.serialize_key = serialize_key
+        self.dumps = dumps
+        self.loads = loads
+        self.timeout = timeout
+        self.touch_batch = touch_batch
+        self._local = local()
+        self._connections = {}
+        self._connections_lock = Lock()
+        self._touched = {}
+        self._touched_lock = Lock()
+
+    def _connection(self):
+        # Connections can't be shared between threads or survive a fork. They are
+        # still opened without the thread check, so that close() can reach them all
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid() or conn not in self._connections:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS memo (key BLOB PRIMARY KEY, value BLOB NOT NULL, '
+                         'expires REAL, used REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS memo_used ON memo (used)')
+            self._local.conn, self._local.pid = conn, os.getpid()
+            with self._connections_lock:
+                self._connections[conn] = os.getpid()
+        return conn
+
+    def get(self, key):
+        '''Return the stored value for key or raise KeyError.'''
+        key = self.serialize_key(key)
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute('SELECT value, expires FROM memo WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] is not None and row[1] <= now:
+            raise KeyError(key)
+        if self.maxsize is not None:
+            with self._touched_lock:
+                self._touched[key] = now
+                flush = len(self._touched) >= self.touch_batch
+            if flush:
+                self._write(conn)
+        return self.loads(row[0])
+
+    def _write(self, conn, row=None):
+        # One transaction: the remembered recency of hits, then the new row and eviction
+        with self._touched_lock:
+            touched, self._touched = self._touched, {}
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('UPDATE memo SET used = ? WHERE key = ?',
+                             [(used, key) for key, used in touched.items()])
+            if row is not None:
+                conn.execute('INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?)', row)
+                if self.ttl is not None:
+                    conn.execute('DELETE FROM memo WHERE expires <= ?', (row[3],))
+                if self.maxsize is not None:
+                    conn.execute('DELETE FROM memo WHERE key IN (SELECT key FROM memo ORDER BY used DESC '
+                                 'LIMIT -1 OFFSET ?)', (self.maxsize,))
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def set(self, key, value):
+        '''Store value for key, then drop expired and excess rows.'''
+        key = self.serialize_key(key)
+        value = self.dumps(value)
+        conn = self._connection()
+        now = time.time()
+        self._write(conn, (key, value, None if self.ttl is None else now + self.ttl, now))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM memo')
+
+    def close(self):
+        '''Write the remembered hits and close all connections.'''
+        if self._touched:
+            self._write(self._connection())
+        with self._connections_lock:
+            connections, self._connections = self._connections, {}
+        for conn, pid in connections.items():
+            # A connection inherited through fork belongs to the parent process
+            if pid == os.getpid():
+                conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        '''Number of rows that have not expired yet.'''
+        return self._connection().execute('SELECT COUNT(*) FROM memo WHERE expires IS NULL OR expires > ?',
+                                          (time.time(),)).fetchone()[0]
+
+
+class _Flight(object):
+    '''A call in progress that concurrent callers with the same key wait for.'''
+    __slots__ = ('owner', 'event', 'result', 'error')
+
+    def __init__(self):
+        self.owner = get_ident()
+        self.event = Event()
+        self.result = None
+        self.error = None
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.event.set()
+
+    def wait(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def memo(func=None, maxsize=None, ttl=None, timer=time.monotonic, single_flight=False, backend=None):
     '''
     Memoize a function so that it caches all return values for
-    faster future lookups.
+    faster future lookups. Can be used bare or with arguments:
+
+    @memo
+    def f(x): ...
+
+    @memo(maxsize=128, ttl=60)
+    def g(x): ...
+
+    maxsize bounds the cache, the least recently used entry is evicted
+    first; ttl is the number of seconds a value stays valid. Keyword
+    arguments are part of the key and falsy results are cached too.
+    The decorated function gets cache_info() with hit, miss and
+    eviction counters and cache_clear().
+
+    With single_flight=True concurrent calls with the same arguments
+    are computed once: the first caller runs the function and the
+    others wait for its result (or exception) and count as hits.
+    Each key in progress has its own event, so callers with
+    different arguments never wait for each other, and a recursive
+    call with the same key from the computing thread runs directly.
+
+    On an async def function the awaited results are cached and
+    concurrent awaits with the same arguments always share one task.
+    A caller that is cancelled does not cancel the shared task.
+
+    backend is a second, shared cache level such as SqliteCache: any
+    object with get(key), raising KeyError on a miss, and set(key,
+    value). It is asked before the function is called and gets every
+    computed result; a value found there counts as a hit. maxsize and
+    ttl only bound the in-process level, the backend has its own.
+    For an async def function the backend is called in the default
+    executor of the event loop, so its I/O doesn't block the loop.
     '''
-    cache = {}
+    if maxsize is not None and maxsize < 1:
+        raise ValueError('maxsize must be positive or None')
 
-    def wrapper(*args, **kwargs):
-        cached = cache.get(tuple(args), None)
-        if cached:
-            return cached
-        res = cache[tuple(args)] = func(*args, **kwargs)
-        return res
+    @decorator
+    def dec(func):
+        cache = OrderedDict()
+        lock = Lock()
+        stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        flights = {}
+        name = (func.__module__, getattr(func, '__qualname__', func.__name__))
+
+        def load(args, kwargs):
+            if backend is None:
+                return False, None
+            try:
+                return True, backend.get(name + (args, tuple(sorted(kwargs.items()))))
+            except KeyError:
+                return False, None
+
+        def save(args, kwargs, res):
+            if backend is not None:
+                backend.set(name + (args, tuple(sorted(kwargs.items()))), res)
+
+        async def compute(key, args, kwargs):
+            # The backend blocks on its I/O, so it runs in the loop's default executor
+            loop = asyncio.get_running_loop()
+            found, res = False, None
+            if backend is not None:
+                found, res = await loop.run_in_executor(None, load, args, kwargs)
+            if not found:
+                res = await func(*args, **kwargs)
+                if backend is not None:
+                    await loop.run_in_executor(None, save, args, kwargs, res)
+            with lock:
+                stats['hits' if found else 'misses'] += 1
+            return res
 
-    return wrapper
+        def store(key, res):
+            now = None if ttl is None else timer()
+            cache[key] = (None if ttl is None else now + ttl, res)
+            cache.move_to_end(key)
+            # Drop expired entries from the least recently used end and
+            # anything over maxsize
+            while cache and (maxsize is not None and len(cache) > maxsize or
+                             ttl is not None and next(iter(cache.values()))[0] <= now):
+                cache.popitem(last=False)
+                stats['evictions'] += 1
+
+        def done(key, task):
+            with lock:
+                del flights[key]
+                if not task.cancelled() and task.exception() is None:
+                    store(key, task.result())
+
+        async def async_wrapper(*args, **kwargs):
+            key = _make_key(args, kwargs)
+            with lock:
+                entry = cache.get(key)
+                if entry is not None and (ttl is None or entry[0] > timer()):
+                    cache.move_to_end(key)
+                    stats['hits'] += 1
+                    return entry[1]
+                task = flights.get(key)
+                if task is not None:
+                    stats['hits'] += 1
+                else:
+                    task = flights[key] = asyncio.ensure_future(compute(key, args, kwargs))
+                    task.add_done_callback(lambda task: done(key, task))
+            return await asyncio.shield(task)
+
+        def wrapper(*args, **kwargs):
+            key = _make_key(args, kwargs)
+            flight = waiting = None
+            with lock:
+                entry = cache.get(key)
+                if entry is not None and (ttl is None or entry[0] > timer()):
+                    cache.move_to_end(key)
+                    stats['hits'] += 1
+                    return entry[1]
+                if key in flights and flights[key].owner != get_ident():
+                    stats['hits'] += 1
+                    waiting = flights[key]
+                elif single_flight and key not in flights:
+                    flight = flights[key] = _Flight()
+            if waiting is not None:
+                return waiting.wait()
+            try:
+                found, res = load(args, kwargs)
+                if not found:
+                    res = func(*args, **kwargs)
+                    save(args, kwargs, res)
+            except BaseException as e:
+                if flight is not None:
+                    with lock:
+                        del flights[key]
+                    flight.finish(error=e)
+                raise
+            with lock:
+                stats['hits' if found else 'misses'] += 1
+                if flight is not None:
+                    del flights[key]
+                store(key, res)
+            if flight is not None:
+                flight.finish(res)
+            return res
+
+        def cache_info():
+            with lock:
+                return CacheInfo(stats['hits'], stats['misses'], stats['evictions'], maxsize, len(cache))
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+                stats.update(hits=0, misses=0, evictions=0)
+
+        if iscoroutinefunction(func):
+            wrapper = async_wrapper
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return dec if func is None else dec(func)
 
 
 @decorator
@@ -107,12 +442,36 @@ def trace(arg):
     ____ <-- fib(1) == 1
      <-- fib(3) == 3
 
+    On an async def function the return line also shows how long the
+    call took to complete, awaits included, and the nesting level is
+    kept per task so concurrent calls don't shift each other:
+
+    ____ <-- fetch(1) == 1 in 0.250s
+
     '''
 
     @decorator
     def dec(func):
         dec.lvl = 0
 
+        if iscoroutinefunction(func):
+            lvl = ContextVar('lvl', default=0)
+
+            async def async_wrapper(*args, **kwargs):
+                indent = str(arg) * lvl.get()
+                print(indent + '-->' + func.__name__ + '(' + ', '.join(map(repr, args)) + ')')
+                token = lvl.set(lvl.get() + 1)
+                started = time.perf_counter()
+                try:
+                    res = await func(*args, **kwargs)
+                finally:
+                    lvl.reset(token)
+                print(indent + '<--' + func.__name__ + '(' + ', '.join(map(repr, args)) + ') == ' + str(res) +
+                      ' in %.3fs' % (time.perf_counter() - started))
+                return res
+
+            return async_wrapper
+
         def wrapper(*args, **kwargs):
             print(str(arg) * dec.lvl + '-->' + func.__name__ + '(' + str(*args) + ')')
             dec.lvl += 1
@@ -148,8 +507,9 @@ def fib(n):
     return 1 if n <= 1 else fib(n - 1) + fib(n - 2)
 
 
-memo = disable
-@memo
+# Turn memoization off for foobar without touching the module level memo
+no_memo = disable
+@no_memo
 @countcalls
 @n_ary
 def foobar(a, b):
@@ -177,5 +537,265 @@ def main():
     print("foobar was called", foobar.calls, "times")
 
 
+def test_memo():
+    print("test_memo...")
+    calls = []
+    now = [0.0]
+
+    @memo(maxsize=2, ttl=10, timer=lambda: now[0])
+    def f(x, y=0):
+        calls.append((x, y))
+        return None if x < 0 else x + y
+
+    # Ложные результаты кэшируются, именованные аргументы входят в ключ
+    assert f(-1) is None and f(-1) is None and calls == [(-1, 0)]
+    assert f(1, y=2) == 3 and f(1, y=2) == 3 and f(1) == 1 and len(calls) == 3
+    assert f.cache_info() == CacheInfo(hits=2, misses=3, evictions=1, maxsize=2, currsize=2)
+    # Вытесняется давно не использованный результат
+    f(1, y=2)
+    f(2)
+    assert f.cache_info().evictions == 2
+    f(1, y=2)
+    assert len(calls) == 4
+    f(1)
+    assert len(calls) == 5
+    # Результаты устаревают через ttl секунд
+    now[0] = 10
+    f(1)
+    assert len(calls) == 6 and f.cache_info().currsize == 1
+    f.cache_clear()
+    assert f.cache_info() == CacheInfo(hits=0, misses=0, evictions=0, maxsize=2, currsize=0)
+    try:
+        memo(maxsize=0)
+    except ValueError:
+        pass
+    else:
+        assert False, 'Empty cache created without errors'
+    print('OK')
+
+
+def test_single_flight():
+    print("test_single_flight...")
+    calls = []
+    release = Event()
+
+    @memo(single_flight=True)
+    def slow(x):
+        calls.append(x)
+        if x != 11:
+            release.wait(5)
+        if x < 0:
+            raise ValueError(x)
+        return x * 2
+
+    def run_concurrently(x, callers=5):
+        results = []
+
+        def call():
+            try:
+                results.append(slow(x))
+            except ValueError as e:
+                results.append(e)
+
+        release.clear()
+        hits = slow.cache_info().hits
+        threads = [Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        # Все, кроме вычисляющего потока, ждут его результата
+        deadline = time.monotonic() + 5
+        while slow.cache_info().hits - hits < callers - 1 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    assert run_concurrently(3) == [6] * 5 and calls == [3]
+    assert slow(3) == 6 and calls == [3]
+    # Исключение получают все ожидавшие, но оно не кэшируется
+    errors = run_concurrently(-1)
+    assert len(errors) == 5 and all(isinstance(e, ValueError) for e in errors) and calls == [3, -1]
+    assert len(run_concurrently(-1)) == 5 and calls == [3, -1, -1]
+    # Вызовы с разными аргументами не ждут друг друга
+    release.clear()
+    first = Thread(target=slow, args=(10,))
+    first.start()
+    while 10 not in calls:
+        time.sleep(0.001)
+    assert slow(11) == 22 and not release.is_set()
+    release.set()
+    first.join()
+
+    # Рекурсивный вызов с тем же ключом из вычисляющего потока не ждет сам себя
+    @memo(single_flight=True)
+    def recursive(x):
+        calls.append(x)
+        return recursive(x) if calls.count(x) == 1 else x
+    assert recursive(7) == 7 and calls.count(7) == 2
+    print('OK')
+
+
+def test_async():
+    print("test_async...")
+    import io
+    import re
+    from contextlib import redirect_stdout
+    calls = []
+    release = asyncio.Event()
+
+    @countcalls
+    @memo
+    async def fetch(x):
+        calls.append(x)
+        await release.wait()
+        if x < 0:
+            raise ValueError(x)
+        return x * 2
+
+    @trace('__')
+    async def nested(n):
+        await asyncio.sleep(0.02)
+        return n if n == 0 else await nested(n - 1)
+
+    @trace('__')
+    async def power(x, n):
+        return x ** n
+
+    async def run():
+        assert iscoroutinefunction(fetch)
+        # Одновременные вызовы с одинаковыми аргументами ждут одну задачу
+        tasks = [asyncio.ensure_future(fetch(1)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        assert await asyncio.gather(*tasks) == [2] * 5 and calls == [1] and fetch.calls == 5
+        assert await fetch(1) == 2 and fetch.cache_info().hits == 5
+        # Исключение получают все ожидавшие, но оно не кэшируется
+        results = await asyncio.gather(fetch(-1), fetch(-1), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results) and calls == [1, -1]
+        await asyncio.gather(fetch(-1), return_exceptions=True)
+        assert calls == [1, -1, -1]
+        # Отмена одного из ожидающих не отменяет общую задачу
+        release.clear()
+        cancelled = asyncio.ensure_future(fetch(3))
+        waiting = asyncio.ensure_future(fetch(3))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await waiting == 6 and cancelled.cancelled() and calls.count(3) == 1
+        assert await fetch(3) == 6 and calls.count(3) == 1
+        await asyncio.gather(nested(1), nested(1))
+
+    output = io.StringIO()
+    with redirect_stdout(output):
+        asyncio.run(run())
+        # Несколько аргументов выводятся через запятую
+        assert asyncio.run(power(2, 3)) == 8
+    lines = output.getvalue().splitlines()
+    assert lines[-2] == "-->power(2, 3)" and lines[-1].startswith("<--power(2, 3) == 8 in ")
+    lines = lines[:-2]
+    # Отступы у каждой задачи свои, время включает ожидание вложенных вызовов
+    assert sorted(line for line in lines if '-->' in line) == ['-->nested(1)'] * 2 + ['__-->nested(0)'] * 2
+    returns = [re.match(r'(_*)<--nested\((\d)\) == \d in (\d+\.\d{3})s$', line) for line in lines if '<--' in line]
+    assert len(returns) == 4 and all(returns)
+    for match in returns:
+        assert len(match.group(1)) == 2 * (1 - int(match.group(2)))
+        assert float(match.group(3)) >= 0.02 * (int(match.group(2)) + 1) - 0.001
+    print('OK')
+
+
+def _store_in_sqlite_cache(path, key, value):
+    SqliteCache(path).set(key, value)
+
+
+def test_sqlite_cache():
+    print("test_sqlite_cache...")
+    import json
+    import tempfile
+    from multiprocessing import Process
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'memo.db')
+        calls = []
+        # Второй экземпляр функции, как после перезапуска процесса, берет результаты из файла
+        for _ in range(2):
+            @memo(backend=SqliteCache(path))
+            def square(x, power=2):
+                calls.append(x)
+                return None if x < 0 else x ** power
+            assert square(3) == 9 and square(3, power=3) == 27 and square(-1) is None
+        assert calls == [3, 3, -1] and square.cache_info()[:2] == (3, 0)
+        square.cache_clear()
+        assert square(3, power=3) == 27 and square.cache_info().hits == 1 and len(calls) == 3
+
+        # Записи, сделанные другим процессом, видны в этом
+        process = Process(target=_store_in_sqlite_cache, args=(path, 'key', [1, 2]))
+        process.start()
+        process.join()
+        assert process.exitcode == 0 and SqliteCache(path).get('key') == [1, 2]
+
+        # При переполнении удаляются давно не использованные записи, в том числе после чтения
+        cache = SqliteCache(os.path.join(directory, 'lru.db'), maxsize=2, touch_batch=1000)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1
+        cache.set('c', 3)
+        assert len(cache) == 2 and cache.get('a') == 1 and cache.get('c') == 3
+        try:
+            cache.get('b')
+        except KeyError:
+            pass
+        else:
+            assert False, 'Least recently used row has not been evicted'
+
+        # Записи устаревают через ttl секунд
+        cache = SqliteCache(os.path.join(directory, 'ttl.db'), ttl=0.05)
+        cache.set('a', 1)
+        assert cache.get('a') == 1 and len(cache) == 1
+        time.sleep(0.06)
+        assert len(cache) == 0
+        cache.set('b', 2)
+        assert len(cache) == 1 and cache.get('b') == 2
+        try:
+            cache.get('a')
+        except KeyError:
+            pass
+        else:
+            assert False, 'Expired row has been returned'
+
+        # Свой сериализатор ключей: словари с разным порядком ключей - один ключ
+        cache = SqliteCache(os.path.join(directory, 'json.db'),
+                            serialize_key=lambda key: json.dumps(key, sort_keys=True), dumps=json.dumps, loads=json.loads)
+        cache.set({'a': 1, 'b': 2}, {'result': 3})
+        assert cache.get({'b': 2, 'a': 1}) == {'result': 3}
+        cache.clear()
+        assert len(cache) == 0
+
+        # Корутины обращаются к файлу в потоках исполнителя, close() закрывает соединения всех потоков
+        threads = []
+
+        class RecordingCache(SqliteCache):
+            def get(self, key):
+                threads.append(get_ident())
+                return SqliteCache.get(self, key)
+
+        with RecordingCache(os.path.join(directory, 'async.db'), maxsize=10) as cache:
+            @memo(backend=cache)
+            async def double(x):
+                return x * 2
+            assert asyncio.run(double(4)) == 8 and len(cache) == 1
+            assert threads and get_ident() not in threads and len(cache._connections) == 2
+        assert not cache._connections
+        assert cache.get((double.__module__, double.__qualname__, (4,), ())) == 8
+        cache.close()
+    print('OK')
+
+
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == '--test':
+        test_memo()
+        test_single_flight()
+        test_async()
+        test_sqlite_cache()
+    else:
+        main()
@@ -6,30 +6,65 @@
 #                     '$status $body_bytes_sent "$http_referer" '
 #                     '"$http_user_agent" "$http_x_forwarded_for" "$http_X_REQUEST_ID" "$http_X_RB_USER" '
 #                     '$request_time';
+import csv
+import ctypes
+import ctypes.util
 import gzip
+import heapq
 import io
 import json
 import logging
+import math
 import optparse
 import os
 import re
+import select
+import struct
+import sys
+import time
+from array import array
 from collections import namedtuple
+from functools import lru_cache
 from datetime import datetime
 from operator import attrgetter
 from os import walk
-from statistics import median
 from string import Template
 
 LogParams = namedtuple('LogParams', 'path date ext')
-ReportParams = namedtuple('ReportParams', 'url count count_perc time_sum time_perc time_avg time_max time_med')
-StatisticParams = namedtuple('StatisticParams', 'count time_sum time_max')
+ReportParams = namedtuple('ReportParams', 'url count count_perc time_sum time_perc time_avg time_max time_med time_p95 slowest')
+SlowRequest = namedtuple('SlowRequest', 'request_time request_id time_local')
+Regression = namedtuple('Regression', 'url impact metrics')
+# The only fields of a log line the statistics need, request id and time are read only for SLOWEST_REQUESTS_SIZE
+LineRecord = namedtuple('LineRecord', 'url request_time request_id time_local', defaults=('-', '-'))
+LINE_GROUPS = ('url', 'request_time', 'http_X_REQUEST_ID', 'time_local')
+
+AGGREGATED_METRICS = ('time_sum', 'time_med', 'time_p95')
+LOG_NAME_REGEXP = r'(nginx-access-ui.log-)(\d{8})(.*)'
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+INOTIFY_EVENT = struct.Struct('iIII')
+
+# Columnar export layout: header (magic, rows, columns), then for every column its name and type code,
+# then column values one column after another. Numbers are little-endian doubles ('d') or int64 ('q'),
+# strings ('s') are uint64 end offsets followed by the utf-8 blob
+COLUMNAR_MAGIC = b'LACOL1'
+COLUMNAR_HEADER = struct.Struct('<6sQH')
+EXPORT_COLUMNS = ReportParams._fields[:-1]
 
 config = {
     "REPORT_SIZE": 1000,
+    "SLOWEST_REQUESTS_SIZE": 5,
     "REPORT_DIR": "./reports",
     "LOG_DIR": "./log",
     "SELF_LOG_DIR": None,
     "REPORT_TEMPLATE_DIR": "./resources",
+    "AGGREGATES_DIR": "./aggregates",
+    "REGRESSION_THRESHOLD_PERCENT": 20,
+    "REGRESSION_MIN_COUNT": 10,
+    "DAEMON_POLL_INTERVAL": 60,
+    "EXPORT_FORMATS": [],
     "LOG_REGEXP": '(?P<remote_addr>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})\s+'
                   '(?P<remote_user>\-|.*)\s+(?P<http_x_real_ip>\-|.*)\s+'
                   '\[(?P<time_local>\d{2}\/[a-zA-Z]{3}\/\d{4}:\d{2}:\d{2}:\d{2}\s+'
@@ -56,7 +91,7 @@ def find_last_log_params(actual_config):
     last_log_params = None
     for (dirpath, dirnames, filenames) in walk(actual_config['LOG_DIR']):
         for f in filenames:
-            match = re.match('(nginx-access-ui.log-)(\d{8})(.*)', f)
+            match = re.match(LOG_NAME_REGEXP, f)
             if match:
                 params = LogParams(path=f, date=datetime.strptime(match.groups()[1], "%Y%m%d").date(), ext=match.groups()[2])
                 if params.ext not in actual_config['ALLOWED_EXTENSIONS']:
@@ -96,19 +131,35 @@ def merge_configs(user_config_path):
         return {**config, **user_config}
 
 
-def get_actual_config_path():
-    parser = optparse.OptionParser('usage: %prog --config <config_path>')
+def get_options():
+    parser = optparse.OptionParser('usage: %prog --config <config_path> [--daemon]')
     parser.add_option('--config', dest='path', type='string', help='specify config file path')
+    parser.add_option('--daemon', dest='daemon', action='store_true', default=False,
+                      help='keep running and analyze new logs as soon as they appear in LOG_DIR')
     (options, args) = parser.parse_args()
-    return options.path
+    return options
+
+
+@lru_cache(maxsize=None)
+def compile_log_regexp(log_regexp):
+    return re.compile(log_regexp)
+
+
+@lru_cache(maxsize=None)
+def line_groups(log_regexp, slowest):
+    # Group numbers of LineRecord fields in the regexp, None for the ones it doesn't capture
+    groupindex = compile_log_regexp(log_regexp).groupindex
+    return tuple(groupindex.get(name) for name in (LINE_GROUPS if slowest else LINE_GROUPS[:2]))
 
 
 def parse_line(actual_config, line):
-    data = re.search(actual_config['LOG_REGEXP'], line)
+    log_regexp = actual_config['LOG_REGEXP']
+    data = compile_log_regexp(log_regexp).search(line)
     if data:
-        datadict = data.groupdict()
-        LineParams = namedtuple('LineParams', ' '.join(datadict.keys()))
-        return LineParams(**datadict)
+        groups = line_groups(log_regexp, actual_config.get('SLOWEST_REQUESTS_SIZE', 0) > 0)
+        if None in groups:
+            return LineRecord(*(data.group(group) if group else '-' for group in groups))
+        return LineRecord(*data.group(*groups))
 
 
 def parse_log(actual_config, log_params):
@@ -127,47 +178,94 @@ def parse_log(actual_config, log_params):
         raise RuntimeError('Allowed percentage of parse errors exceeded')
 
 
-def calculate_statistics(parsed_data_gen):
+def push_slow_request(heap, size, data, data_time):
+    # Min-heap of at most `size` slowest requests: the fastest of them is always on top.
+    # Most requests are faster than it, so the entry is built only for those that get in
+    if len(heap) < size:
+        heapq.heappush(heap, SlowRequest(data_time, data.request_id, data.time_local))
+    elif heap[0].request_time < data_time:
+        heapq.heapreplace(heap, SlowRequest(data_time, data.request_id, data.time_local))
+
+
+def median(ordered):
+    # Median of already sorted values
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+def percentile(ordered, perc):
+    # Nearest-rank percentile of already sorted values
+    return ordered[max(int(math.ceil(perc / 100.0 * len(ordered))) - 1, 0)]
+
+
+class UrlStatistics(object):
+    # Per-url aggregate updated in place, one object per url instead of one per parsed line.
+    # Percentages are taken against the totals at the url's last occurrence, as reports always did
+    __slots__ = ('url', 'count', 'time_sum', 'time_max', 'times', 'slowest', 'last_total_count', 'last_total_time')
+
+    def __init__(self, url):
+        self.url = url
+        self.count = 0
+        self.time_sum = 0.0
+        self.time_max = 0.0
+        self.times = array('d')
+        self.slowest = []
+        self.last_total_count = 0
+        self.last_total_time = 0.0
+
+    def to_report_params(self):
+        # One sort serves both the median and the percentile
+        ordered = sorted(self.times)
+        return ReportParams(
+            self.url,
+            self.count,
+            self.count * 100.0 / self.last_total_count,
+            self.time_sum,
+            self.time_sum * 100.0 / self.last_total_time if self.last_total_time else 0.0,
+            self.time_sum / self.count,
+            self.time_max,
+            median(ordered),
+            percentile(ordered, 95),
+            self.slowest
+        )
+
+
+def calculate_statistics(actual_config, parsed_data_gen):
     statistics = {}
     total_count = 0
     total_time = 0.0
-    times = {}
+    slowest_size = actual_config['SLOWEST_REQUESTS_SIZE']
     for data in parsed_data_gen:
         total_count += 1
         data_time = float(data.request_time)
         total_time += data_time
-        try:
-            current = statistics[data.url]
-        except KeyError:
-            current = None
-        if not current:
-            params = StatisticParams(1, data_time, data_time)
-            times[data.url] = [data_time]
-        else:
-            times[data.url].append(data_time)
-            params = StatisticParams(
-                current.count + 1,
-                current.time_sum + data_time,
-                current.time_max if current.time_max - data_time > 0 else data_time)
-        statistics[data.url] = ReportParams(
-            data.url,
-            params.count,
-            params.count * 100.0 / total_count,
-            params.time_sum,
-            params.time_sum * 100.0 / total_time,
-            params.time_sum / params.count,
-            params.time_max,
-            median(times[data.url])
-        )
-        logging.debug('Processed ' + str(total_count) + ' lines')
-    return statistics.values()
+        current = statistics.get(data.url)
+        if current is None:
+            url = sys.intern(data.url)
+            current = statistics[url] = UrlStatistics(url)
+        current.count += 1
+        current.time_sum += data_time
+        if current.time_max < data_time:
+            current.time_max = data_time
+        current.times.append(data_time)
+        current.last_total_count = total_count
+        current.last_total_time = total_time
+        if slowest_size > 0:
+            push_slow_request(current.slowest, slowest_size, data, data_time)
+        logging.debug('Processed %d lines', total_count)
+    return [current.to_report_params() for current in statistics.values()]
 
 
 def prepare_json(actual_config, data):
     res = []
     logging.info('Sorting report')
     for params in sorted(data, key=attrgetter('time_sum'), reverse=True)[:actual_config['REPORT_SIZE']]:
-        res.append(params._asdict())
+        row = params._asdict()
+        if row['slowest']:
+            row['slowest'] = [slow._asdict() for slow in sorted(row['slowest'], reverse=True)]
+        else:
+            del row['slowest']
+        res.append(row)
     logging.info('Returning data json for further processing')
     return json.dumps(res)
 
@@ -178,9 +276,187 @@ def generate_report(actual_config, report_data):
     return Template(html).safe_substitute(table_json=report_data)
 
 
+def export_csv(f, rows):
+    writer = csv.writer(f)
+    writer.writerow(EXPORT_COLUMNS)
+    for params in rows:
+        writer.writerow(params[:len(EXPORT_COLUMNS)])
+
+
+def export_ndjson(f, rows):
+    for params in rows:
+        f.write(json.dumps(dict(zip(EXPORT_COLUMNS, params))))
+        f.write('\n')
+
+
+def column_type(column):
+    return 's' if column == 'url' else 'q' if column == 'count' else 'd'
+
+
+def export_columnar(f, rows):
+    f.write(COLUMNAR_HEADER.pack(COLUMNAR_MAGIC, len(rows), len(EXPORT_COLUMNS)))
+    for column in EXPORT_COLUMNS:
+        name = column.encode('utf-8')
+        f.write(struct.pack('<H', len(name)) + name + column_type(column).encode('ascii'))
+    for i, column in enumerate(EXPORT_COLUMNS):
+        if column_type(column) == 's':
+            offsets = array('Q')
+            end = 0
+            for params in rows:
+                end += len(params[i].encode('utf-8'))
+                offsets.append(end)
+            write_array(f, offsets)
+            for params in rows:
+                f.write(params[i].encode('utf-8'))
+        else:
+            write_array(f, array(column_type(column), (params[i] for params in rows)))
+
+
+def write_array(f, values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    values.tofile(f)
+
+
+def load_columnar(path):
+    with open(path, 'rb') as f:
+        magic, rows, columns_count = COLUMNAR_HEADER.unpack(f.read(COLUMNAR_HEADER.size))
+        if magic != COLUMNAR_MAGIC:
+            raise ValueError('%s is not a columnar export' % path)
+        columns = []
+        for _ in range(columns_count):
+            (length,) = struct.unpack('<H', f.read(2))
+            columns.append((f.read(length).decode('utf-8'), f.read(1).decode('ascii')))
+        data = {}
+        for column, code in columns:
+            values = array('Q' if code == 's' else code)
+            values.fromfile(f, rows)
+            if sys.byteorder != 'little':
+                values.byteswap()
+            if code == 's':
+                blob = f.read(values[-1] if rows else 0)
+                starts = [0] + values.tolist()
+                data[column] = [blob[starts[j]:starts[j + 1]].decode('utf-8') for j in range(rows)]
+            else:
+                data[column] = values
+        return data
+
+
+EXPORTERS = {
+    'csv': (export_csv, {'mode': 'w', 'encoding': 'UTF-8', 'newline': ''}),
+    'ndjson': (export_ndjson, {'mode': 'w', 'encoding': 'UTF-8'}),
+    'col': (export_columnar, {'mode': 'wb'}),
+}
+
+
+def get_export_formats(actual_config):
+    formats = actual_config['EXPORT_FORMATS']
+    if isinstance(formats, str):
+        formats = [f.strip(" '[]") for f in formats.split(',')]
+    formats = [f for f in formats if f]
+    for export_format in formats:
+        if export_format not in EXPORTERS:
+            raise ValueError('Unknown export format %s' % export_format)
+    return formats
+
+
+def create_exports(actual_config, report_data, date):
+    rows = sorted(report_data, key=attrgetter('time_sum'), reverse=True)
+    for export_format in get_export_formats(actual_config):
+        exporter, open_params = EXPORTERS[export_format]
+        logging.info('Saving %s export' % export_format)
+        with open(
+                os.path.join(
+                    actual_config['REPORT_DIR'],
+                    'report-%s.%s' % (date.strftime("%Y.%m.%d"), export_format)
+                ), **open_params
+        ) as f:
+            exporter(f, rows)
+
+
+def aggregates_path(actual_config, date):
+    return os.path.join(actual_config['AGGREGATES_DIR'], 'aggregates-%s.json' % date.strftime("%Y.%m.%d"))
+
+
+def aggregate(report_data):
+    return {params.url: {'count': params.count, **{m: getattr(params, m) for m in AGGREGATED_METRICS}}
+            for params in report_data}
+
+
+def save_aggregates(actual_config, aggregates, date):
+    os.makedirs(actual_config['AGGREGATES_DIR'], exist_ok=True)
+    with open(aggregates_path(actual_config, date), 'w', encoding='UTF-8') as f:
+        json.dump(aggregates, f)
+
+
+def load_previous_aggregates(actual_config, date):
+    previous_date = None
+    if not os.path.isdir(actual_config['AGGREGATES_DIR']):
+        return None, None
+    for f in os.listdir(actual_config['AGGREGATES_DIR']):
+        match = re.match(r'aggregates-(\d{4}\.\d{2}\.\d{2})\.json$', f)
+        if match:
+            aggregates_date = datetime.strptime(match.group(1), "%Y.%m.%d").date()
+            if aggregates_date < date and (not previous_date or previous_date < aggregates_date):
+                previous_date = aggregates_date
+    if not previous_date:
+        return None, None
+    with open(aggregates_path(actual_config, previous_date), 'r', encoding='UTF-8') as f:
+        return previous_date, json.load(f)
+
+
+def find_regressions(actual_config, current, previous):
+    # Only slowdowns of urls requested at least REGRESSION_MIN_COUNT times on both days are reported:
+    # timings of rare urls are too noisy to compare
+    threshold = actual_config['REGRESSION_THRESHOLD_PERCENT']
+    min_count = actual_config['REGRESSION_MIN_COUNT']
+    regressions = []
+    for url, params in current.items():
+        old = previous.get(url)
+        if not old or params['count'] < min_count or old['count'] < min_count:
+            continue
+        metrics = {}
+        for metric in AGGREGATED_METRICS:
+            if old[metric] > 0:
+                change = (params[metric] - old[metric]) * 100.0 / old[metric]
+                if change > threshold:
+                    metrics[metric] = {'old': old[metric], 'new': params[metric], 'change_perc': change}
+        if metrics:
+            # Impact is how many seconds of total processing time the url gained per day
+            regressions.append(Regression(url, params['time_sum'] - old['time_sum'], metrics))
+    return sorted(regressions, key=attrgetter('impact'), reverse=True)
+
+
+def create_regression_report(actual_config, report_data, date):
+    current = aggregate(report_data)
+    previous_date, previous = load_previous_aggregates(actual_config, date)
+    save_aggregates(actual_config, current, date)
+    if previous is None:
+        logging.info('There are no previous aggregates to compare with')
+        return
+    logging.info('Comparing statistics with aggregates for %s' % previous_date)
+    regressions = find_regressions(actual_config, current, previous)
+    if regressions:
+        logging.warning('%d urls slowed down since %s, the largest impact %.3f s at %s' % (
+            len(regressions), previous_date, regressions[0].impact, regressions[0].url))
+    with open(
+            os.path.join(
+                actual_config['REPORT_DIR'],
+                'regression-%s.json' % date.strftime("%Y.%m.%d")
+            ), 'w', encoding='UTF-8'
+    ) as f:
+        json.dump({'previous_date': previous_date.strftime("%Y.%m.%d"),
+                   'regressions': [r._asdict() for r in regressions]}, f)
+
+
 def create_report(actual_config, parsed_data_gen, log_params):
+    # Check export formats before anything is written: once the html report exists the log is not parsed again
+    get_export_formats(actual_config)
     logging.info('Calculating statistics')
-    report_data = calculate_statistics(parsed_data_gen)
+    report_data = calculate_statistics(actual_config, parsed_data_gen)
+    if actual_config['AGGREGATES_DIR']:
+        logging.info('Saving aggregates and searching for regressions')
+        create_regression_report(actual_config, report_data, log_params.date)
     logging.info('Generating html report')
     report = generate_report(actual_config, prepare_json(actual_config, report_data))
     date = log_params.date
@@ -192,6 +468,7 @@ def create_report(actual_config, parsed_data_gen, log_params):
             ), 'w', encoding='UTF-8'
     ) as f:
         f.write(report)
+    create_exports(actual_config, report_data, date)
 
 
 def update_logger_config(actual_config):
@@ -210,12 +487,81 @@ def update_logger_config(actual_config):
         log.addHandler(new_handler)
 
 
-def main():
-    logging.info('Script started. Getting actual config')
-    actual_config_path = get_actual_config_path()
-    actual_config = merge_configs(actual_config_path)
-    update_logger_config(actual_config)
+class InotifyWatcher(object):
+
+    def __init__(self, path):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'Could not initialize inotify')
+        if self._libc.inotify_add_watch(self._fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, 'Could not watch %s' % path)
+
+    def wait(self, timeout):
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self._fd, 64 * 1024)
+        names = set()
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            names.add(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher(object):
+    # A new file is reported only once its size and mtime are the same in two polls in a row,
+    # so a log that is still being written is not analyzed partially
+
+    def __init__(self, path):
+        self._path = path
+        self._seen = set(os.listdir(path))
+        self._pending = {}
+
+    def _file_state(self, name):
+        try:
+            stat = os.stat(os.path.join(self._path, name))
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        current = set(os.listdir(self._path))
+        names = set()
+        pending = {}
+        for name in current - self._seen:
+            state = self._file_state(name)
+            if state is not None and self._pending.get(name) == state:
+                names.add(name)
+            elif state is not None:
+                pending[name] = state
+        self._seen = (self._seen & current) | names
+        self._pending = pending
+        return names
+
+    def close(self):
+        pass
+
+
+def create_watcher(actual_config):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(actual_config['LOG_DIR'])
+        except (OSError, AttributeError, TypeError) as e:
+            logging.info('inotify is not available (%s), falling back to polling' % e)
+    return PollingWatcher(actual_config['LOG_DIR'])
+
 
+def analyze(actual_config):
     logging.info('Searching for latest log file')
     log_params = find_last_log_params(actual_config)
     if not log_params:
@@ -234,6 +580,40 @@ def main():
     create_report(actual_config, parsed_data_gen, log_params)
 
 
+def run_daemon(actual_config):
+    watcher = create_watcher(actual_config)
+    logging.info('Watching %s for new logs with %s' % (actual_config['LOG_DIR'], type(watcher).__name__))
+    try:
+        try:
+            analyze(actual_config)
+        except Exception as e:
+            logging.error(e, exc_info=True)
+        while True:
+            names = watcher.wait(actual_config['DAEMON_POLL_INTERVAL'])
+            if not any(re.match(LOG_NAME_REGEXP, name) for name in names):
+                continue
+            logging.info('New log files appeared: %s' % ', '.join(sorted(names)))
+            try:
+                analyze(actual_config)
+            except Exception as e:
+                logging.error(e, exc_info=True)
+    finally:
+        watcher.close()
+
+
+def main():
+    logging.info('Script started. Getting actual config')
+    options = get_options()
+    actual_config = merge_configs(options.path)
+    update_logger_config(actual_config)
+    get_export_formats(actual_config)
+
+    if options.daemon:
+        run_daemon(actual_config)
+    else:
+        analyze(actual_config)
+
+
 if __name__ == "__main__":
     try:
         main()
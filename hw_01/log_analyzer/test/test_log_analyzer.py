@@ -1,6 +1,10 @@
+import csv
+import json
 import os
+import tempfile
 import unittest
 from collections import namedtuple
+from unittest import mock
 from datetime import datetime
 
 import log_analyzer
@@ -18,15 +22,22 @@ EMPTY_LOG_DATE = datetime.strptime('20161209', "%Y%m%d").date()
 NOT_EMPTY_LOG_DATE = datetime.strptime('20170802', "%Y%m%d").date()
 USER_ALLOWED_ERRORS_PERCENT = 25
 DEFAULT_ALLOWED_ERRORS_PERCENT = 15
-CONFIG_SIZE = 10
+CONFIG_SIZE = 16
+SLOWEST_REQUESTS_SIZE = 3
 ANOTHER_REGEXP = '(?P<method>GET|POST|UPDATE|DELETE)\s+(?P<url>.+)\s+HTTP/1.[0-1].+\s+(?P<request_time>\d+.\d+)$'
 
 test_config = {
     "REPORT_SIZE": 100,
+    "SLOWEST_REQUESTS_SIZE": 0,
     "REPORT_DIR": "../src/reports",
     "LOG_DIR": "../src/log",
     "SELF_LOG_DIR": None,
     "REPORT_TEMPLATE_DIR": "../src/resources",
+    "AGGREGATES_DIR": None,
+    "REGRESSION_THRESHOLD_PERCENT": 20,
+    "REGRESSION_MIN_COUNT": 5,
+    "DAEMON_POLL_INTERVAL": 60,
+    "EXPORT_FORMATS": [],
     "LOG_REGEXP": '(?P<remote_addr>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})\s+(?P<remote_user>\-|.*)\s+(?P<http_x_real_ip>\-|.*)\s+\[(?P<time_local>\d{2}\/[a-zA-Z]{3}\/\d{4}:\d{2}:\d{2}:\d{2}\s+(?P<offset_tz>(?P<offset_dir>\+|\-)(?P<offset_hour>\d{2})(?P<offset_min>\d{2})))\]\s+(?P<request>\"(?P<method>GET|POST|UPDATE|DELETE)\s+(?P<url>.+)\s+(?P<http_version>HTTP\/1\.[0-1])\")\s+(?P<status>\d{3})\s+(?P<body_bytes_sent>\d+)\s+\"(?P<http_referer>.+)\"\s+\"(?P<http_user_agent>.+)\"\s+\"(?P<http_x_forwarded_for>\-|.*)\"\s+\"(?P<http_X_REQUEST_ID>.+)\"\s+\"(?P<http_X_RB_USER>\-|.*)\"\s+(?P<request_time>.+)',
     "ALLOWED_ERRORS_PERCENT": 15,
     "ALLOWED_EXTENSIONS": ['', '.gz', 'zip'],
@@ -199,6 +210,173 @@ class LogAnalyzerTest(unittest.TestCase):
         self.assertEqual(expected, actual, 'Generated report is not equal to sample')
         os.remove(actual_path)
 
+    def test_slowest_requests(self):
+        """
+        Проверяем правильность отбора самых медленных запросов по каждому url
+        """
+        slowest_config = {**test_config, "SLOWEST_REQUESTS_SIZE": SLOWEST_REQUESTS_SIZE}
+        statistics = log_analyzer.calculate_statistics(
+            slowest_config,
+            log_analyzer.parse_log(
+                slowest_config,
+                LogParams(path='test_not_empty_log-20170802', date=NOT_EMPTY_LOG_DATE, ext='')
+            )
+        )
+        times = {}
+        for line in log_analyzer.parse_log(
+                test_config,
+                LogParams(path='test_not_empty_log-20170802', date=NOT_EMPTY_LOG_DATE, ext='')):
+            times.setdefault(line.url, []).append(float(line.request_time))
+        for params in statistics:
+            self.assertEqual(
+                sorted(slow.request_time for slow in params.slowest),
+                sorted(times[params.url])[-SLOWEST_REQUESTS_SIZE:],
+                'Wrong slowest requests chosen for %s' % params.url
+            )
+
+        # Единственный запрос первого url из тестового лога
+        banner = [params for params in statistics if params.url == '/api/v2/banner/25019354'][0]
+        self.assertIn(
+            ('1498697422-2190034393-4708-9752759', '29/Jun/2017:03:50:22 +0300'),
+            [(slow.request_id, slow.time_local) for slow in banner.slowest],
+            'Request id or time is parsed wrong'
+        )
+
+    def test_find_regressions(self):
+        """
+        Проверяем правильность поиска регрессий относительно агрегатов прошлого дня
+        """
+        previous = {
+            '/fast': {'count': 10, 'time_sum': 1.0, 'time_med': 0.1, 'time_p95': 0.1},
+            '/slow': {'count': 10, 'time_sum': 10.0, 'time_med': 1.0, 'time_p95': 1.0},
+            '/same': {'count': 10, 'time_sum': 5.0, 'time_med': 0.5, 'time_p95': 0.5},
+            '/faster': {'count': 10, 'time_sum': 10.0, 'time_med': 1.0, 'time_p95': 1.0},
+            '/rare': {'count': 1, 'time_sum': 1.0, 'time_med': 1.0, 'time_p95': 1.0},
+        }
+        current = {
+            '/fast': {'count': 10, 'time_sum': 2.0, 'time_med': 0.2, 'time_p95': 0.2},
+            '/slow': {'count': 10, 'time_sum': 30.0, 'time_med': 3.0, 'time_p95': 3.0},
+            '/same': {'count': 10, 'time_sum': 5.5, 'time_med': 0.55, 'time_p95': 0.55},
+            '/new': {'count': 1, 'time_sum': 100.0, 'time_med': 100.0, 'time_p95': 100.0},
+            '/faster': {'count': 10, 'time_sum': 1.0, 'time_med': 0.1, 'time_p95': 0.1},
+            '/rare': {'count': 1, 'time_sum': 50.0, 'time_med': 50.0, 'time_p95': 50.0},
+        }
+        regressions = log_analyzer.find_regressions(test_config, current, previous)
+        self.assertEqual([r.url for r in regressions], ['/slow', '/fast'], 'Wrong regressions found')
+        self.assertEqual(regressions[0].impact, 20.0, 'Wrong regression impact')
+        self.assertEqual(set(regressions[0].metrics), {'time_sum', 'time_med', 'time_p95'}, 'Wrong regressed metrics')
+
+    def test_create_regression_report(self):
+        """
+        Проверяем сохранение агрегатов и сравнение с последними сохранёнными агрегатами
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            actual_config = {**test_config, 'AGGREGATES_DIR': tmp_dir, 'REPORT_DIR': tmp_dir}
+            log_params = LogParams(path='test_not_empty_log-20170802', date=NOT_EMPTY_LOG_DATE, ext='')
+            report_data = log_analyzer.calculate_statistics(actual_config, log_analyzer.parse_log(test_config, log_params))
+
+            # Первый день - сравнивать не с чем
+            log_analyzer.create_regression_report(actual_config, report_data, EMPTY_LOG_DATE)
+            self.assertTrue(os.path.exists(log_analyzer.aggregates_path(actual_config, EMPTY_LOG_DATE)),
+                            'Aggregates have not been saved')
+            self.assertFalse(os.path.exists(os.path.join(tmp_dir, 'regression-2016.12.09.json')),
+                             'Regression report without previous aggregates')
+
+            # Те же данные на следующий день - регрессий нет
+            log_analyzer.create_regression_report(actual_config, report_data, NOT_EMPTY_LOG_DATE)
+            with open(os.path.join(tmp_dir, 'regression-2017.08.02.json'), 'r', encoding='UTF-8') as f:
+                regression_report = json.load(f)
+            self.assertEqual(regression_report['previous_date'], '2016.12.09', 'Wrong previous aggregates chosen')
+            self.assertEqual(regression_report['regressions'], [], 'Regressions found in the same data')
+
+    def test_watchers(self):
+        """
+        Проверяем, что наблюдатели за LOG_DIR замечают появление нового лога
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, 'nginx-access-ui.log-20170801'), 'w'):
+                pass
+            watchers = [log_analyzer.PollingWatcher(tmp_dir)]
+            watcher = log_analyzer.create_watcher({**test_config, 'LOG_DIR': tmp_dir})
+            if isinstance(watcher, log_analyzer.InotifyWatcher):
+                watchers.append(watcher)
+            for watcher in watchers:
+                self.assertEqual(watcher.wait(0), set(), 'Existing log is reported as new')
+            with open(os.path.join(tmp_dir, 'nginx-access-ui.log-20170802'), 'w') as f:
+                f.write('log')
+            # Поллинг сообщает о файле, только когда его размер и время изменения не меняются между опросами
+            self.assertEqual(watchers[0].wait(0), set(), 'Log that may be still written is reported')
+            with open(os.path.join(tmp_dir, 'nginx-access-ui.log-20170802'), 'a') as f:
+                f.write('more log')
+            self.assertEqual(watchers[0].wait(0), set(), 'Growing log is reported')
+            for watcher in watchers:
+                self.assertEqual(watcher.wait(1), {'nginx-access-ui.log-20170802'}, 'New log has not been noticed')
+                self.assertEqual(watcher.wait(0), set(), 'Log is reported twice')
+                watcher.close()
+
+    def test_daemon_survives_failed_analysis(self):
+        """
+        Проверяем, что ошибка разбора последнего лога при запуске демона не останавливает его
+        """
+        class StopDaemon(Exception):
+            pass
+
+        class Watcher(object):
+            closed = False
+
+            def wait(self, timeout):
+                raise StopDaemon()
+
+            def close(self):
+                self.closed = True
+
+        watcher = Watcher()
+        failure = RuntimeError('Allowed percentage of parse errors exceeded')
+        with mock.patch.object(log_analyzer, 'create_watcher', return_value=watcher), \
+                mock.patch.object(log_analyzer, 'analyze', side_effect=failure) as analyze:
+            with self.assertRaises(StopDaemon, msg='Daemon stopped on the first failed analysis'):
+                log_analyzer.run_daemon(test_config)
+        self.assertEqual(analyze.call_count, 1, 'Latest log has not been analyzed at start')
+        self.assertTrue(watcher.closed, 'Watcher has not been closed')
+
+    def test_create_exports(self):
+        """
+        Проверяем выгрузку статистики по всем url в csv, ndjson и колоночный формат
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            actual_config = {**test_config, 'REPORT_DIR': tmp_dir, 'REPORT_SIZE': 1, 'EXPORT_FORMATS': 'csv, ndjson,col'}
+            log_params = LogParams(path='test_not_empty_log-20170802', date=NOT_EMPTY_LOG_DATE, ext='')
+            report_data = log_analyzer.calculate_statistics(actual_config, log_analyzer.parse_log(test_config, log_params))
+            log_analyzer.create_exports(actual_config, report_data, NOT_EMPTY_LOG_DATE)
+            expected = sorted(report_data, key=lambda params: params.time_sum, reverse=True)
+
+            with open(os.path.join(tmp_dir, 'report-2017.08.02.csv'), 'r', encoding='UTF-8', newline='') as f:
+                csv_rows = list(csv.DictReader(f))
+            self.assertEqual(len(csv_rows), len(expected), 'Not all urls are exported to csv')
+            self.assertEqual(csv_rows[0]['url'], expected[0].url, 'Wrong first url in csv')
+            self.assertEqual(float(csv_rows[0]['time_p95']), expected[0].time_p95, 'Wrong time_p95 in csv')
+
+            with open(os.path.join(tmp_dir, 'report-2017.08.02.ndjson'), 'r', encoding='UTF-8') as f:
+                ndjson_rows = [json.loads(line) for line in f]
+            self.assertEqual([row['url'] for row in ndjson_rows], [params.url for params in expected],
+                             'Wrong urls in ndjson')
+
+            columns = log_analyzer.load_columnar(os.path.join(tmp_dir, 'report-2017.08.02.col'))
+            self.assertEqual(list(columns), list(log_analyzer.EXPORT_COLUMNS), 'Wrong columns in columnar export')
+            for column in log_analyzer.EXPORT_COLUMNS:
+                self.assertEqual(list(columns[column]), [getattr(params, column) for params in expected],
+                                 'Wrong %s column in columnar export' % column)
+
+        with self.assertRaises(ValueError, msg='Unknown export format processed without errors'):
+            log_analyzer.create_exports({**test_config, 'EXPORT_FORMATS': ['xml']}, [], NOT_EMPTY_LOG_DATE)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            actual_config = {**test_config, 'REPORT_DIR': tmp_dir, 'EXPORT_FORMATS': 'csv,xml'}
+            log_params = LogParams(path='test_not_empty_log-20170802', date=NOT_EMPTY_LOG_DATE, ext='')
+            with self.assertRaises(ValueError, msg='Unknown export format processed without errors'):
+                log_analyzer.create_report(actual_config, log_analyzer.parse_log(test_config, log_params), log_params)
+            self.assertEqual(os.listdir(tmp_dir), [], 'Report written before export formats were checked')
+
 
 if __name__ == "__main__":
     unittest.main()
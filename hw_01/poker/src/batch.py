@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Пакетная оценка "рук" на NumPy.
+# "Руки" передаются массивом целых чисел формы (N, 5) или (N, 7) в кодировке poker.py
+# (карта - число suit * 13 + rank от 0 до 51), результат - массив сил рук
+# (те же числа от 1 до 7462, что возвращает poker.hand_strength).
+# -----------------
+import numpy as np
+
+from poker import (CARDS, CARD_INTS, FLUSH_STRENGTH, POPCOUNT, PRIME_PRODUCT_STRENGTH, RANK_MASK,
+                   STRAIGHT_MASK, _rank_product, _top_bits, evaluate_hand, evaluate_mask, strength5)
+
+DEFAULT_CHUNK_SIZE = 100000
+
+# Те же таблицы, что и в poker.py, в виде массивов NumPy, индексируемых 13ти битной маской рангов
+FLUSH_TABLE = np.array(FLUSH_STRENGTH, dtype=np.int16)
+STRAIGHT_TABLE = np.array(STRAIGHT_MASK, dtype=np.int64)
+POPCOUNT_TABLE = np.array(POPCOUNT, dtype=np.int8)
+TOP_BITS_TABLES = {n: np.array([_top_bits(mask, n) for mask in range(RANK_MASK + 1)], dtype=np.int64)
+                   for n in (1, 2, 3, 5)}
+MASK_PRIMES_TABLE = np.array([_rank_product(mask, 1) for mask in range(RANK_MASK + 1)], dtype=np.int64)
+PRIME_KEYS = np.array(sorted(PRIME_PRODUCT_STRENGTH), dtype=np.int64)
+PRIME_VALUES = np.array([PRIME_PRODUCT_STRENGTH[key] for key in PRIME_KEYS.tolist()], dtype=np.int16)
+
+
+def hands_to_array(hands):
+    """Переводит последовательность "рук" в строковом формате в массив целых чисел"""
+    return np.array([[CARD_INTS[card] for card in hand] for hand in hands], dtype=np.int8)
+
+
+def _check_cards(cards):
+    cards = np.asarray(cards)
+    if cards.ndim != 2 or cards.shape[1] < 5:
+        raise ValueError('Hands must be an array of shape (N, 5) or more cards per hand, got %s' % (cards.shape,))
+    # astype молча отбросил бы дробную часть номеров карт
+    if cards.size and not np.issubdtype(cards.dtype, np.integer):
+        raise ValueError('Cards must be integers, got an array of %s' % cards.dtype)
+    if cards.size and (cards.min() < 0 or cards.max() >= len(CARDS)):
+        raise ValueError('Cards must be integers from 0 to %d' % (len(CARDS) - 1))
+    # Повторы карт в строке схлопнулись бы в маске и дали бы неверную силу руки
+    if cards.size and (np.diff(np.sort(cards, axis=1), axis=1) == 0).any():
+        raise ValueError('Some hands contain duplicate cards')
+    return cards.astype(np.int64)
+
+
+def _evaluate_masks(masks):
+    """Векторный вариант poker.evaluate_mask: сила лучшей руки для массива 52х битных масок"""
+    suits = [(masks >> (13 * suit)) & RANK_MASK for suit in range(4)]
+    ones = np.zeros_like(masks)
+    twos = np.zeros_like(masks)
+    fours = np.zeros_like(masks)
+    for suited in suits:
+        carry = ones & suited
+        ones ^= suited
+        fours |= twos & carry
+        twos ^= carry
+    ranks = suits[0] | suits[1] | suits[2] | suits[3]
+    trips = ones & twos
+    pairs = twos & ~ones
+    top1, top2, top3, top5 = (TOP_BITS_TABLES[n] for n in (1, 2, 3, 5))
+    primes = MASK_PRIMES_TABLE
+    quad = top1[fours]
+    trip = top1[trips]
+    two_pairs = top2[pairs]
+    keys = np.select(
+        [
+            fours != 0,
+            (trips != 0) & (((trips & (trips - 1)) != 0) | (pairs != 0)),
+            STRAIGHT_TABLE[ranks] != 0,
+            trips != 0,
+            (pairs & (pairs - 1)) != 0,
+            pairs != 0,
+        ],
+        [
+            primes[quad] ** 4 * primes[top1[ranks ^ quad]],
+            primes[trip] ** 3 * primes[top1[(trips ^ trip) | pairs]] ** 2,
+            primes[STRAIGHT_TABLE[ranks]],
+            primes[trips] ** 3 * primes[top2[ranks ^ trips]],
+            primes[two_pairs] ** 2 * primes[top1[ranks ^ two_pairs]],
+            primes[pairs] ** 2 * primes[top3[ranks ^ pairs]],
+        ],
+        primes[top5[ranks]]
+    )
+    result = PRIME_VALUES[np.searchsorted(PRIME_KEYS, keys)]
+    for suited in suits:
+        flush = STRAIGHT_TABLE[suited]
+        flush = np.where(flush != 0, flush, top5[suited])
+        result = np.where(POPCOUNT_TABLE[suited] >= 5, np.maximum(result, FLUSH_TABLE[flush]), result)
+    return result
+
+
+def evaluate_batch(cards, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Возвращает массив сил лучших рук из 5ти карт для массива "рук" формы (N, 5), (N, 7)
+    или с любым другим числом карт не меньше пяти. Массив обрабатывается частями по chunk_size рук,
+    чтобы ограничить расход памяти на промежуточные массивы"""
+    cards = _check_cards(cards)
+    result = np.empty(len(cards), dtype=np.int16)
+    for start in range(0, len(cards), chunk_size):
+        chunk = cards[start:start + chunk_size]
+        result[start:start + chunk_size] = _evaluate_masks(np.bitwise_or.reduce(np.int64(1) << chunk, axis=1))
+    return result
+
+
+def test_evaluate_batch():
+    print("test_evaluate_batch...")
+    rnd = np.random.default_rng(5)
+    for n in (5, 6, 7, 8):
+        cards = np.array([rnd.permutation(len(CARDS))[:n] for _ in range(3000)])
+        strengths = evaluate_batch(cards, chunk_size=1000)
+        if n == 5:
+            expected = [strength5(hand) for hand in cards.tolist()]
+        else:
+            expected = [evaluate_mask(sum(1 << card for card in hand))[0] for hand in cards.tolist()]
+        assert strengths.tolist() == expected
+    hands = ["6C 7C 8C 9C TC 5C JS".split(), "TD TC TH 7C 7D 8C 8S".split()]
+    assert evaluate_batch(hands_to_array(hands)).tolist() == [evaluate_hand(hand)[0] for hand in hands]
+    assert len(evaluate_batch(np.empty((0, 7), dtype=np.int8))) == 0
+    for wrong in (np.zeros((3, 4), dtype=np.int8), [[0, 0, 0, 0, 0]], [[0, 1, 2, 3, 4], [5, 6, 7, 8, 5]],
+                  [[0, 1, 2, 3, 4.5]]):
+        try:
+            evaluate_batch(wrong)
+        except ValueError:
+            pass
+        else:
+            assert False, 'Wrong hands evaluated without errors: %s' % (wrong,)
+    print('OK')
+
+
+if __name__ == '__main__':
+    test_evaluate_batch()
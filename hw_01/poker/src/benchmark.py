@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Замеры скорости оценки рук на фиксированных наборах рук.
+# Наборы строятся генератором случайных чисел с заданным seed: руки из 5ти карт,
+# руки из 7ми карт и руки из 7ми карт с 0, 1 и 2 джокерами. Для каждой функции
+# выводится число рук в секунду (лучший из нескольких прогонов), результаты каждой
+# быстрой функции сверяются с эталонной реализацией. Результаты можно сохранить
+# как базовые (--save-baseline) и при следующих запусках сравнивать с ними:
+# замедление больше чем на --threshold процентов считается регрессией.
+#
+# Запуск: python3 benchmark.py [--size N] [--seed N] [--repeat N] [--threshold PERCENT] [--baseline path [--save-baseline]]
+# -----------------
+import json
+import optparse
+import random
+import sys
+import time
+from collections import namedtuple
+from functools import lru_cache
+from itertools import combinations, combinations_with_replacement
+
+from poker import (CARDS, RANKS, SUITS, _freeze, best_hand, best_wild_hand, card_ranks, evaluate_mask, flush,
+                   hand_rank, hand_strength, hand_to_mask, reference_best_wild_hand, reference_hand_rank,
+                   strength_to_hand_rank)
+
+try:
+    import numpy
+    from batch import evaluate_batch, hands_to_array
+except ImportError:
+    numpy = None
+
+DEFAULT_SIZE = 20000
+DEFAULT_SEED = 1
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD_PERCENT = 20
+HAND_CLASSES = 7462
+WHEEL = [14, 5, 4, 3, 2]
+# Эталонная оценка рук с джокерами перебирает все замены, поэтому сверяется только часть набора
+CROSS_CHECK_SIZES = {0: 2000, 1: 200, 2: 20}
+JOKERS = {0: [], 1: ['?B'], 2: ['?B', '?R']}
+
+Benchmark = namedtuple('Benchmark', 'name corpus evaluate reference')
+BenchmarkResult = namedtuple('BenchmarkResult', 'name hands hands_per_sec mismatches baseline regression')
+
+
+def get_options(args=None):
+    parser = optparse.OptionParser('usage: %prog [--size N] [--seed N] [--repeat N] [--threshold PERCENT] '
+                                   '[--baseline path [--save-baseline]]')
+    parser.add_option('--size', dest='size', type='int', default=DEFAULT_SIZE, help='hands in each corpus')
+    parser.add_option('--seed', dest='seed', type='int', default=DEFAULT_SEED, help='corpora random seed')
+    parser.add_option('--repeat', dest='repeat', type='int', default=DEFAULT_REPEAT,
+                      help='timed runs of each benchmark, the best one is reported')
+    parser.add_option('--baseline', dest='baseline', type='string', help='baseline results file (json)')
+    parser.add_option('--save-baseline', dest='save_baseline', action='store_true', default=False,
+                      help='save results to the baseline file instead of comparing with it')
+    parser.add_option('--threshold', dest='threshold', type='float', default=DEFAULT_THRESHOLD_PERCENT,
+                      help='slowdown in percent against the baseline reported as a regression')
+    (options, args) = parser.parse_args(args)
+    if options.save_baseline and not options.baseline:
+        parser.error('--save-baseline requires --baseline')
+    return options
+
+
+def make_corpora(size, seed):
+    """Наборы рук: 'hand5', 'hand7' и 'jokers0', 'jokers1', 'jokers2' (7 карт с учетом джокеров)"""
+    rnd = random.Random(seed)
+    corpora = {
+        'hand5': [rnd.sample(CARDS, 5) for _ in range(size)],
+        'hand7': [rnd.sample(CARDS, 7) for _ in range(size)],
+    }
+    for count, jokers in JOKERS.items():
+        corpus = []
+        for _ in range(size):
+            hand = rnd.sample(CARDS, 7 - count) + jokers
+            rnd.shuffle(hand)
+            corpus.append(hand)
+        corpora['jokers%d' % count] = corpus
+    return corpora
+
+
+def _reference_key(hand):
+    """reference_hand_rank, приведенный к полному порядку рук: ранги двух пар идут по убыванию
+    (исходная реализация берет их в порядке множества), а A-5-4-3-2 - стрит с пятеркой
+    (в исходной реализации туз всегда старший)"""
+    rank = reference_hand_rank(hand)
+    if card_ranks(hand) == WHEEL:
+        rank = (8 if flush(hand) else 4, 5)
+    elif rank[0] == 2:
+        rank = (2, tuple(sorted(rank[1], reverse=True)), rank[2])
+    return _freeze(rank)
+
+
+@lru_cache(maxsize=None)
+def _reference_strengths():
+    """Словарь {_reference_key: сила} по всем классам рук из 5ти карт. Классы перечисляются
+    и упорядочиваются только эталонной оценкой, без таблиц poker.py, поэтому ошибка в таблицах
+    не может совпасть с эталоном"""
+    classes = set()
+    for ranks in combinations_with_replacement(RANKS, 5):
+        if max(ranks.count(rank) for rank in ranks) <= len(SUITS):
+            # Одинаковые ранги идут подряд и получают разные масти, флеша не получается
+            classes.add(_reference_key([rank + SUITS[i % len(SUITS)] for i, rank in enumerate(ranks)]))
+    for ranks in combinations(RANKS, 5):
+        classes.add(_reference_key([rank + SUITS[0] for rank in ranks]))
+    assert len(classes) == HAND_CLASSES
+    return {key: strength for strength, key in enumerate(sorted(classes), 1)}
+
+
+def _reference_strength(hand):
+    """Сила руки из 5ти карт по эталонному hand_rank"""
+    return _reference_strengths()[_reference_key(hand)]
+
+
+def _reference_best_strength(hand):
+    """Сила лучшей руки из 5ти карт перебором сочетаний с эталонной оценкой"""
+    return max(_reference_strength(five) for five in combinations(hand, 5))
+
+
+def get_benchmarks():
+    """Список замеров: имя, набор рук, быстрая функция и эталонная функция для сверки
+    (обе возвращают значения, которые можно сравнить на равенство)"""
+    benchmarks = [
+        Benchmark('hand_rank', 'hand5', hand_rank, lambda hand: strength_to_hand_rank(_reference_strength(hand))),
+        Benchmark('hand_strength', 'hand5', hand_strength, _reference_strength),
+        Benchmark('best_hand', 'hand7', lambda hand: hand_strength(best_hand(hand)), _reference_best_strength),
+        Benchmark('evaluate_mask', 'hand7', lambda hand: evaluate_mask(hand_to_mask(hand))[0],
+                  _reference_best_strength),
+    ]
+    for count in JOKERS:
+        benchmarks.append(Benchmark('best_wild_hand[%d jokers]' % count, 'jokers%d' % count,
+                                    lambda hand: hand_strength(best_wild_hand(hand)),
+                                    lambda hand: hand_strength(reference_best_wild_hand(hand))))
+    return benchmarks
+
+
+def run_benchmark(benchmark, corpus, repeat):
+    """Возвращает (рук в секунду по лучшему прогону, результаты последнего прогона)"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results = list(map(benchmark.evaluate, corpus))
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return len(corpus) / best if best else float('inf'), results
+
+
+def run_batch_benchmark(corpus, repeat):
+    """Замер batch.evaluate_batch на наборе рук из 7ми карт, если установлен NumPy"""
+    cards = hands_to_array(corpus)
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results = evaluate_batch(cards)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    expected = [evaluate_mask(hand_to_mask(hand))[0] for hand in corpus]
+    return len(corpus) / best if best else float('inf'), sum(1 for a, b in zip(results.tolist(), expected) if a != b)
+
+
+def cross_check(benchmark, corpus, results, count):
+    """Число рук из первых count, на которых быстрая функция расходится с эталонной"""
+    return sum(1 for hand, result in zip(corpus[:count], results) if result != benchmark.reference(hand))
+
+
+def run_benchmarks(size=DEFAULT_SIZE, seed=DEFAULT_SEED, repeat=DEFAULT_REPEAT, baseline=None,
+                   threshold=DEFAULT_THRESHOLD_PERCENT):
+    """Выполняет все замеры и возвращает список BenchmarkResult"""
+    baseline = baseline or {}
+    corpora = make_corpora(size, seed)
+    measured = []
+    for benchmark in get_benchmarks():
+        corpus = corpora[benchmark.corpus]
+        hands_per_sec, results = run_benchmark(benchmark, corpus, repeat)
+        jokers = int(benchmark.corpus[-1]) if benchmark.corpus.startswith('jokers') else 0
+        mismatches = cross_check(benchmark, corpus, results, CROSS_CHECK_SIZES[jokers])
+        measured.append((benchmark.name, len(corpus), hands_per_sec, mismatches))
+    if numpy is not None:
+        hands_per_sec, mismatches = run_batch_benchmark(corpora['hand7'], repeat)
+        measured.append(('evaluate_batch', size, hands_per_sec, mismatches))
+    report = []
+    for name, hands, hands_per_sec, mismatches in measured:
+        expected = baseline.get(name)
+        regression = expected is not None and hands_per_sec < expected * (1 - threshold / 100.0)
+        report.append(BenchmarkResult(name, hands, hands_per_sec, mismatches, expected, regression))
+    return report
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(path, report):
+    with open(path, 'w') as f:
+        json.dump({result.name: result.hands_per_sec for result in report}, f, indent=2, sort_keys=True)
+
+
+def format_report(report):
+    lines = ['%-26s %8s %12s %12s  %s' % ('benchmark', 'hands', 'hands/sec', 'baseline', 'status')]
+    for result in report:
+        status = []
+        if result.mismatches:
+            status.append('MISMATCH(%d)' % result.mismatches)
+        if result.regression:
+            status.append('REGRESSION(%+.0f%%)' % (100.0 * result.hands_per_sec / result.baseline - 100))
+        lines.append('%-26s %8d %12.0f %12s  %s' % (
+            result.name, result.hands, result.hands_per_sec,
+            '-' if result.baseline is None else '%.0f' % result.baseline, ' '.join(status) or 'OK'))
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    options = get_options(args)
+    baseline = load_baseline(options.baseline) if options.baseline and not options.save_baseline else None
+    report = run_benchmarks(options.size, options.seed, options.repeat, baseline, options.threshold)
+    print(format_report(report))
+    if options.save_baseline:
+        save_baseline(options.baseline, report)
+    return any(result.mismatches or result.regression for result in report)
+
+
+def test_benchmarks():
+    print("test_benchmarks...")
+    import os
+    import tempfile
+    assert make_corpora(10, 3) == make_corpora(10, 3)
+    assert all(len(hand) == 7 and hand.count('?B') == (count > 0) and hand.count('?R') == (count > 1)
+               for count in JOKERS for hand in make_corpora(10, 3)['jokers%d' % count])
+    report = run_benchmarks(size=30, repeat=1)
+    assert all(result.hands == 30 and result.hands_per_sec > 0 and not result.mismatches for result in report)
+    assert not any(result.regression for result in report)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'baseline.json')
+        save_baseline(path, report)
+        baseline = load_baseline(path)
+        # Базовая скорость в тысячу раз выше текущей - регрессия у всех замеров
+        report = run_benchmarks(size=30, repeat=1, baseline={name: speed * 1000 for name, speed in baseline.items()})
+        assert all(result.regression for result in report)
+        assert 'REGRESSION' in format_report(report)
+    print('OK')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--test':
+        test_benchmarks()
+    else:
+        sys.exit(1 if main() else 0)
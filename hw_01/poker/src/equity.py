@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Расчет эквити (доли банка, которую в среднем получает игрок).
+# Игрокам известны карманные карты, часть общих карт (board) и, возможно,
+# вышедшие из игры карты (dead). Недостающие общие карты либо раздаются случайно
+# методом Монте-Карло в пуле процессов (у каждой порции раздач - свой воспроизводимый
+# генератор), либо перебираются все без исключения.
+# -----------------
+import math
+import random
+from collections import namedtuple
+from functools import lru_cache
+from itertools import combinations, permutations
+from multiprocessing import Pool
+
+from poker import CARDS, POPCOUNT, RANK_MASK, RANKS, SUITS, evaluate_mask, hand_to_mask
+
+BOARD_SIZE = 5
+DEFAULT_BATCH_SIZE = 2000
+DEFAULT_MAX_SAMPLES = 1000000
+DEFAULT_PRECISION = 0.005
+# Квантиль нормального распределения для 95% доверительного интервала
+Z_95 = 1.959964
+# Во сколько раз число попыток раздачи может превышать число разыгранных раздач
+MAX_REJECTIONS = 100
+SUIT_PERMUTATIONS = list(permutations(range(len(SUITS))))
+# Сколько канонических раздач exact_equity держит в кэше
+EXACT_CACHE_SIZE = 1024
+# Маска рангов масти, разнесенная по 3х битным счетчикам: сумма по мастям - число карт каждого ранга
+RANK_COUNTS = [sum(1 << 3 * rank for rank in range(len(RANKS)) if mask >> rank & 1) for mask in range(RANK_MASK + 1)]
+
+PlayerEquity = namedtuple('PlayerEquity', 'win tie equity interval')
+EquityResult = namedtuple('EquityResult', 'players samples exact')
+
+
+def holdem_strength(hole_mask, board_mask):
+    """Сила лучшей руки из 5ти карт по карманным и общим картам (техасский холдем)"""
+    return evaluate_mask(hole_mask | board_mask)[0]
+
+
+def parse_cards(cards):
+    """Переводит карты в строковом формате ('AS KD' или ['AS', 'KD']) в 52х битную маску"""
+    if isinstance(cards, str):
+        cards = cards.split()
+    return hand_to_mask(cards)
+
+
+def prepare_spot(players, board, dead, board_size=BOARD_SIZE):
+    """Переводит раздачу в маски и проверяет, что ни одна карта не встречается дважды.
+    Возвращает (маски игроков, маска общих карт, оставшиеся в колоде карты)"""
+    if len(players) < 2:
+        raise ValueError('At least two players are required')
+    known = []
+    for cards in (*players, board, dead):
+        known.extend(cards.split() if isinstance(cards, str) else cards)
+    if len(set(known)) < len(known):
+        raise ValueError('Some cards are dealt more than once')
+    board_mask = parse_cards(board)
+    if bin(board_mask).count('1') > board_size:
+        raise ValueError('Board can not contain more than %d cards' % board_size)
+    used = hand_to_mask(known)
+    deck = [card for card in range(len(CARDS)) if not used >> card & 1]
+    return [parse_cards(cards) for cards in players], board_mask, deck
+
+
+def showdown_shares(strengths):
+    """Доли банка игроков при заданных силах рук: банк делится поровну между сильнейшими.
+    Если силы рук - пары (старшая, младшая), как в Омахе-8, половина банка делится по старшим
+    рукам, половина - по младшим. Если младшей руки (силы больше 0) нет ни у кого,
+    весь банк делится по старшим рукам"""
+    if isinstance(strengths[0], tuple):
+        high = showdown_shares([strength[0] for strength in strengths])
+        lows = [strength[1] for strength in strengths]
+        if not max(lows):
+            return high
+        return [(h + l) / 2 for h, l in zip(high, showdown_shares(lows))]
+    best = max(strengths)
+    winners = strengths.count(best)
+    return [1.0 / winners if strength == best else 0.0 for strength in strengths]
+
+
+class EquityAccumulator(object):
+    """Накопитель результатов раздач: победы, ничьи, сумма и сумма квадратов долей банка"""
+
+    def __init__(self, players_count):
+        self.samples = 0
+        self.wins = [0] * players_count
+        self.ties = [0] * players_count
+        self.shares = [0.0] * players_count
+        self.squares = [0.0] * players_count
+
+    def add_showdown(self, strengths, weight=1):
+        shares = showdown_shares(strengths)
+        tie = shares.count(0.0) < len(shares) - 1
+        for i, share in enumerate(shares):
+            if share:
+                if tie:
+                    self.ties[i] += weight
+                else:
+                    self.wins[i] += weight
+                self.shares[i] += share * weight
+                self.squares[i] += share * share * weight
+        self.samples += weight
+
+    def merge(self, other):
+        self.samples += other.samples
+        for i in range(len(self.wins)):
+            self.wins[i] += other.wins[i]
+            self.ties[i] += other.ties[i]
+            self.shares[i] += other.shares[i]
+            self.squares[i] += other.squares[i]
+
+    def half_width(self, i):
+        """Половина ширины 95% доверительного интервала эквити игрока i"""
+        if self.samples < 2:
+            return 1.0
+        mean = self.shares[i] / self.samples
+        variance = max(self.squares[i] / self.samples - mean * mean, 0.0)
+        return Z_95 * math.sqrt(variance / self.samples)
+
+    def result(self, exact=False):
+        players = []
+        for i in range(len(self.wins)):
+            equity = self.shares[i] / self.samples if self.samples else 0.0
+            half_width = 0.0 if exact else self.half_width(i)
+            players.append(PlayerEquity(
+                self.wins[i] / self.samples if self.samples else 0.0,
+                self.ties[i] / self.samples if self.samples else 0.0,
+                equity,
+                (max(equity - half_width, 0.0), min(equity + half_width, 1.0))
+            ))
+        return EquityResult(players, self.samples, exact)
+
+
+def _simulate(task):
+    """Разыгрывает порцию случайных раздач. Выполняется в процессе пула.
+    Карманные карты каждого игрока выбираются из его диапазона (маски комбинаций и
+    накопленные веса), раздачи с пересекающимися картами отбрасываются"""
+    player_ranges, board_mask, deck, missing, extra, samples, seed, evaluator = task
+    rnd = random.Random(seed)
+    accumulator = EquityAccumulator(len(player_ranges))
+    attempts = 0
+    while accumulator.samples < samples:
+        attempts += 1
+        if attempts > samples * MAX_REJECTIONS:
+            raise ValueError('Player ranges do not have non-overlapping combinations')
+        used = 0
+        holes = []
+        for masks, cum_weights in player_ranges:
+            hole = masks[0] if len(masks) == 1 else rnd.choices(masks, cum_weights=cum_weights)[0]
+            if hole & used:
+                break
+            used |= hole
+            holes.append(hole)
+        else:
+            board = board_mask
+            need = missing
+            for card in rnd.sample(deck, missing + extra):
+                if need and not used >> card & 1:
+                    board |= 1 << card
+                    need -= 1
+            accumulator.add_showdown([evaluator(hole, board) for hole in holes])
+    return accumulator
+
+
+def run_monte_carlo(player_ranges, board_mask, deck, missing, precision=DEFAULT_PRECISION,
+                    max_samples=DEFAULT_MAX_SAMPLES, batch_size=DEFAULT_BATCH_SIZE, processes=None, seed=0,
+                    evaluator=holdem_strength):
+    """Разыгрывает раздачи порциями в пуле процессов до достижения точности precision.
+    player_ranges - для каждого игрока пара (маски возможных карманных карт, накопленные веса)"""
+    # Сколько карт колоды могут оказаться на руках у игроков, заданных диапазонами.
+    # Карты игроков с единственной комбинацией в deck входить не должны
+    extra = sum(max(bin(mask).count('1') for mask in masks) for masks, _ in player_ranges if len(masks) > 1)
+    accumulator = EquityAccumulator(len(player_ranges))
+    tasks = (
+        (player_ranges, board_mask, deck, missing, extra, batch_size, '%s:%d' % (seed, i), evaluator)
+        for i in range(int(math.ceil(max_samples / float(batch_size))))
+    )
+    pool = Pool(processes) if processes != 1 else None
+    try:
+        for batch in (pool.imap(_simulate, tasks) if pool else map(_simulate, tasks)):
+            accumulator.merge(batch)
+            if all(accumulator.half_width(i) <= precision for i in range(len(player_ranges))):
+                break
+    finally:
+        if pool:
+            pool.terminate()
+    return accumulator.result()
+
+
+def monte_carlo_equity(players, board=(), dead=(), precision=DEFAULT_PRECISION, max_samples=DEFAULT_MAX_SAMPLES,
+                       batch_size=DEFAULT_BATCH_SIZE, processes=None, seed=0, evaluator=holdem_strength,
+                       board_size=BOARD_SIZE):
+    """Оценивает эквити игроков случайными раздачами недостающих общих карт.
+    Раздачи выполняются порциями по batch_size в пуле из processes процессов (1 - без пула).
+    Генератор порции i инициализируется строкой '<seed>:<i>', поэтому результат зависит
+    только от seed, а не от числа процессов. Расчет останавливается, когда 95% доверительный
+    интервал эквити каждого игрока становится уже +-precision или разыграно max_samples раздач"""
+    player_masks, board_mask, deck = prepare_spot(players, board, dead, board_size)
+    return run_monte_carlo([([mask], [1]) for mask in player_masks], board_mask, deck,
+                           board_size - bin(board_mask).count('1'), precision, max_samples, batch_size, processes,
+                           seed, evaluator)
+
+
+def permute_suits(mask, permutation):
+    """Переставляет масти карт маски: карты масти suit переходят в масть permutation[suit]"""
+    result = 0
+    for suit, target in enumerate(permutation):
+        result |= ((mask >> (13 * suit)) & RANK_MASK) << (13 * target)
+    return result
+
+
+def canonical_spot(masks):
+    """Представитель класса раздач, переходящих друг в друга при перестановке мастей.
+    У изоморфных раздач эквити одинаково"""
+    return min(tuple(permute_suits(mask, permutation) for mask in masks) for permutation in SUIT_PERMUTATIONS)
+
+
+def suit_stabilizer(masks):
+    """Перестановки мастей, не меняющие ни одну из масок"""
+    return [permutation for permutation in SUIT_PERMUTATIONS
+            if all(permute_suits(mask, permutation) == mask for mask in masks)]
+
+
+def exact_equity(players, board=(), dead=(), evaluator=holdem_strength, board_size=BOARD_SIZE):
+    """Точное эквити игроков перебором всех вариантов недостающих общих карт.
+    Варианты, переходящие друг в друга при перестановках мастей, не меняющих известные карты,
+    оцениваются один раз с весом, равным числу таких вариантов. Силы рук на досках, где ни у кого
+    не может быть флеша, запоминаются по рангам доски и не вычисляются повторно (evaluator должен
+    зависеть от мастей только через флеши). Результаты последних EXACT_CACHE_SIZE раздач запоминаются
+    для канонического представителя раздачи, поэтому изоморфные раздачи считаются один раз"""
+    player_masks, board_mask, _ = prepare_spot(players, board, dead, board_size)
+    # Эквити канонической раздачи совпадает с исходным: порядок игроков при перестановке мастей не меняется
+    return _exact_spot(canonical_spot([*player_masks, board_mask, parse_cards(dead)]), evaluator, board_size)
+
+
+@lru_cache(maxsize=EXACT_CACHE_SIZE)
+def _exact_spot(spot, evaluator, board_size):
+    """exact_equity для раздачи в виде масок (игроки..., общие карты, вышедшие карты).
+    Веса вариантов доски копятся по исходам (силам рук игроков), а для досок без возможного флеша -
+    по рангам доски, и каждый исход добавляется в накопитель один раз"""
+    *player_masks, board_mask, dead_mask = spot
+    used = board_mask | dead_mask
+    for hole in player_masks:
+        used |= hole
+    group = suit_stabilizer(spot)
+    # Перестановка мастей как сдвиги 13ти битных масок мастей
+    shifts = [tuple(13 * target for target in permutation) for permutation in group
+              if permutation != tuple(range(len(SUITS)))]
+    # Доска, на которой масти suit не меньше flush_cards[suit] карт, может дать кому-то флеш
+    n0, n1, n2, n3 = (5 - max(POPCOUNT[(hole >> 13 * suit) & RANK_MASK] for hole in player_masks)
+                      for suit in range(len(SUITS)))
+    k0, k1, k2, k3 = ((board_mask >> 13 * suit) & RANK_MASK for suit in range(len(SUITS)))
+    outcomes = {}
+    rank_weights = {}
+    rank_boards = {}
+    bits = [1 << card for card in range(len(CARDS)) if not used >> card & 1]
+    for runout in combinations(bits, board_size - bin(board_mask).count('1')):
+        runout = sum(runout)
+        r0 = runout & RANK_MASK
+        r1 = (runout >> 13) & RANK_MASK
+        r2 = (runout >> 26) & RANK_MASK
+        r3 = runout >> 39
+        # Вариант считается только для наименьшего образа в своей орбите, вес - размер орбиты
+        fixed = 1
+        for s0, s1, s2, s3 in shifts:
+            image = r0 << s0 | r1 << s1 | r2 << s2 | r3 << s3
+            if image < runout:
+                break
+            fixed += image == runout
+        else:
+            weight = len(group) // fixed
+            b0, b1, b2, b3 = k0 | r0, k1 | r1, k2 | r2, k3 | r3
+            if POPCOUNT[b0] >= n0 or POPCOUNT[b1] >= n1 or POPCOUNT[b2] >= n2 or POPCOUNT[b3] >= n3:
+                board = board_mask | runout
+                outcome = tuple(evaluator(hole, board) for hole in player_masks)
+                outcomes[outcome] = outcomes.get(outcome, 0) + weight
+            else:
+                ranks = RANK_COUNTS[b0] + RANK_COUNTS[b1] + RANK_COUNTS[b2] + RANK_COUNTS[b3]
+                if ranks in rank_weights:
+                    rank_weights[ranks] += weight
+                else:
+                    rank_weights[ranks] = weight
+                    rank_boards[ranks] = board_mask | runout
+    for ranks, weight in rank_weights.items():
+        outcome = tuple(evaluator(hole, rank_boards[ranks]) for hole in player_masks)
+        outcomes[outcome] = outcomes.get(outcome, 0) + weight
+    accumulator = EquityAccumulator(len(player_masks))
+    for outcome, weight in outcomes.items():
+        accumulator.add_showdown(list(outcome), weight)
+    return accumulator.result(exact=True)
+
+
+def test_exact_equity():
+    print("test_exact_equity...")
+    # Без учета изоморфизма мастей на терне: 44 варианта ривера
+    players = [hand_to_mask("AS KS".split()), hand_to_mask("QH QD".split())]
+    board = hand_to_mask("2S 7S JC 3D".split())
+    shares = [0.0, 0.0]
+    for card in range(len(CARDS)):
+        if not (players[0] | players[1] | board) >> card & 1:
+            for i, share in enumerate(showdown_shares([holdem_strength(hole, board | 1 << card) for hole in players])):
+                shares[i] += share
+    result = exact_equity(["AS KS", "QH QD"], board="2S 7S JC 3D")
+    assert result.exact and result.samples == 44
+    assert [round(player.equity * 44, 9) for player in result.players] == [round(share, 9) for share in shares]
+
+    # Флоп, у которого есть симметрия мастей: трефы и бубны взаимозаменяемы
+    result = exact_equity(["AS AH", "KS KH"], board="2S 7H 9S")
+    assert result.samples == 990 and abs(sum(player.equity for player in result.players) - 1.0) < 1e-9
+    expected = EquityAccumulator(2)
+    masks = [hand_to_mask("AS AH".split()), hand_to_mask("KS KH".split())]
+    flop = hand_to_mask("2S 7H 9S".split())
+    for runout in combinations([c for c in range(len(CARDS)) if not (flop | masks[0] | masks[1]) >> c & 1], 2):
+        expected.add_showdown([holdem_strength(hole, flop | 1 << runout[0] | 1 << runout[1]) for hole in masks])
+    assert result == expected.result(exact=True)
+
+    # Изоморфная раздача берется из кэша
+    hits = _exact_spot.cache_info().hits
+    assert exact_equity(["AC AD", "KC KD"], board="2C 7D 9C") == result
+    assert _exact_spot.cache_info().hits == hits + 1
+
+    # Доски без возможного флеша берутся по рангам: результат совпадает с оценкой каждой доски
+    players = [hand_to_mask("AS KS".split()), hand_to_mask("7H 7D".split())]
+    board = hand_to_mask("7S 2S QC".split())
+    expected = EquityAccumulator(2)
+    deck = [c for c in range(len(CARDS)) if not (board | players[0] | players[1]) >> c & 1]
+    for runout in combinations(deck, 2):
+        expected.add_showdown([holdem_strength(hole, board | 1 << runout[0] | 1 << runout[1]) for hole in players])
+    assert exact_equity(["AS KS", "7H 7D"], board="7S 2S QC") == expected.result(exact=True)
+    print('OK')
+
+
+def test_monte_carlo_equity():
+    print("test_monte_carlo_equity...")
+    result = monte_carlo_equity(["AS AH".split(), "KS KH".split()], precision=0.01, processes=1, seed=1)
+    aces, kings = result.players
+    assert 0.80 < aces.equity < 0.85
+    assert abs(aces.equity + kings.equity - 1.0) < 1e-9
+    assert aces.interval[1] - aces.interval[0] <= 0.02
+    assert result == monte_carlo_equity(["AS AH".split(), "KS KH".split()], precision=0.01, processes=2, seed=1)
+
+    # На ривере исход известен заранее
+    result = monte_carlo_equity(["AS AH", "KS KH"], board="2C 7D 9H JC QS", max_samples=10, batch_size=10, processes=1)
+    assert [player.win for player in result.players] == [1.0, 0.0]
+
+    # Одинаковые руки при флеше на борде делят банк
+    result = monte_carlo_equity(["2S 3S", "2D 3D"], board="AC KC QC 9C", dead="TC", processes=1, precision=0.02)
+    assert result.players[0].tie > 0.7 and abs(result.players[0].equity - 0.5) < 1e-9
+
+    try:
+        monte_carlo_equity(["AS AH", "AS KH"], processes=1)
+    except ValueError:
+        pass
+    else:
+        assert False, 'Duplicated cards processed without errors'
+    print('OK')
+
+
+if __name__ == '__main__':
+    test_monte_carlo_equity()
+    test_exact_equity()
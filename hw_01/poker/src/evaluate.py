@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Потоковая оценка "рук" из файлов или стандартного ввода.
+# Каждая строка входа - "рука" из 5ти и более карт через пробел в нотации poker.py
+# (джокеры '?B' и '?R' допускаются). Для каждой строки в том же порядке выводится
+# строка: исходная "рука", лучшая "рука" из 5ти карт и ее сила через табуляцию.
+# Строки с ошибками выводятся с пометкой ERROR, пустые строки пропускаются.
+# Джокеров в строке не больше MAX_JOKERS: без таблиц замен время оценки растет
+# экспоненциально с числом джокеров, и одна такая строка задержала бы весь вывод.
+# Строки читаются порциями, порции оцениваются в пуле процессов, при этом в работе
+# одновременно находится не больше нескольких порций на процесс, поэтому расход памяти
+# не зависит от размера входа.
+#
+# Запуск: python3 evaluate.py [--processes N] [--chunk-size N] [файл ...]
+# -----------------
+import logging
+import optparse
+import sys
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+
+from poker import JOKER_SUITS, evaluate_wild_mask, hand_to_mask, mask_to_hand
+
+DEFAULT_CHUNK_SIZE = 10000
+CHUNKS_PER_PROCESS = 2
+MIN_HAND_SIZE = 5
+MAX_JOKERS = 2
+ERROR = 'ERROR'
+
+
+def get_options(args=None):
+    parser = optparse.OptionParser('usage: %prog [--processes N] [--chunk-size N] [file ...]')
+    parser.add_option('--processes', dest='processes', type='int', default=None,
+                      help='number of worker processes, 1 evaluates hands in the current process')
+    parser.add_option('--chunk-size', dest='chunk_size', type='int', default=DEFAULT_CHUNK_SIZE,
+                      help='number of hands sent to a worker at once')
+    (options, args) = parser.parse_args(args)
+    if options.processes is not None and options.processes < 1:
+        parser.error('--processes must be positive')
+    if options.chunk_size < 1:
+        parser.error('--chunk-size must be positive')
+    return options, args
+
+
+def evaluate_line(line):
+    """Оценивает одну строку входа и возвращает строку результата"""
+    hand = line.split()
+    try:
+        cards = [card for card in hand if card not in JOKER_SUITS]
+        mask = hand_to_mask(cards)
+        if len(hand) < MIN_HAND_SIZE:
+            raise ValueError('Hand must contain at least %d cards' % MIN_HAND_SIZE)
+        if len(hand) - len(cards) > MAX_JOKERS:
+            raise ValueError('Hand must contain at most %d jokers' % MAX_JOKERS)
+        if bin(mask).count('1') != len(cards):
+            raise ValueError('Hand contains duplicate cards')
+        strength, best_mask = evaluate_wild_mask(mask, [JOKER_SUITS[card] for card in hand if card in JOKER_SUITS])
+    except KeyError as e:
+        return '%s\t%s\tUnknown card %s' % (' '.join(hand), ERROR, e.args[0])
+    except ValueError as e:
+        return '%s\t%s\t%s' % (' '.join(hand), ERROR, e)
+    return '%s\t%s\t%d' % (' '.join(hand), ' '.join(mask_to_hand(best_mask)), strength)
+
+
+def evaluate_chunk(lines):
+    """Оценивает порцию строк. Выполняется в процессе пула"""
+    return [evaluate_line(line) for line in lines]
+
+
+def read_chunks(files, chunk_size):
+    """Читает непустые строки из файлов порциями по chunk_size"""
+    lines = (line for f in files for line in f if line.strip())
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def imap_bounded(func, tasks, processes=None):
+    """Генератор результатов func для заданий tasks в порядке заданий. Задания читаются по мере
+    выполнения: в пуле одновременно находится не больше CHUNKS_PER_PROCESS заданий на процесс.
+    processes=1 - задания выполняются в текущем процессе"""
+    if processes == 1:
+        yield from map(func, tasks)
+        return
+    pool = Pool(processes)
+    try:
+        pending = deque()
+        limit = CHUNKS_PER_PROCESS * (processes or cpu_count())
+        for task in tasks:
+            pending.append(pool.apply_async(func, (task,)))
+            if len(pending) >= limit:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+
+def evaluate_stream(files, processes=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Генератор результатов оценки строк из файлов в порядке входа"""
+    for results in imap_bounded(evaluate_chunk, read_chunks(files, chunk_size), processes):
+        yield from results
+
+
+def open_inputs(paths):
+    """Открывает входные файлы, '-' или отсутствие файлов означает стандартный ввод"""
+    for path in paths or ['-']:
+        if path == '-':
+            yield sys.stdin
+        else:
+            with open(path) as f:
+                yield f
+
+
+def main(args=None, output=None):
+    options, paths = get_options(args)
+    output = output or sys.stdout
+    errors = 0
+    for result in evaluate_stream(open_inputs(paths), options.processes, options.chunk_size):
+        if result.split('\t')[1] == ERROR:
+            errors += 1
+        output.write(result + '\n')
+    if errors:
+        logging.warning('%d hands could not be evaluated', errors)
+    return errors
+
+
+def test_evaluate_stream():
+    print("test_evaluate_stream...")
+    import io
+    import random
+    from poker import CARDS, evaluate_hand
+    rnd = random.Random(11)
+    hands = [' '.join(rnd.sample(CARDS, 7)) for _ in range(500)]
+    expected = ['%s\t%s\t%d' % (hand, ' '.join(mask_to_hand(hand_to_mask(evaluate_hand(hand.split())[1]))),
+                                evaluate_hand(hand.split())[0]) for hand in hands]
+    for processes in (1, 2):
+        files = [io.StringIO('\n'.join(hands[:200]) + '\n\n'), io.StringIO('\n'.join(hands[200:]))]
+        assert list(evaluate_stream(files, processes=processes, chunk_size=7)) == expected
+    assert evaluate_line("6C 7C 8C 9C TC 5C ?B").split('\t')[1:] == ['7C 8C 9C TC JC', '7459']
+    assert evaluate_line("AS KS ?R ?B 2C").split('\t')[1] != ERROR
+    for wrong in ("AS KS QS", "AS KS QS JS XX", "AS AS KS QS JS", "?B ?B ?B ?B ?B ?B ?B"):
+        assert evaluate_line(wrong).split('\t')[1] == ERROR
+    output = io.StringIO()
+    stdin, sys.stdin = sys.stdin, io.StringIO("AS KS QS JS TS\nAS KS\n")
+    try:
+        assert main(['--processes', '1'], output) == 1
+    finally:
+        sys.stdin = stdin
+    assert output.getvalue().splitlines()[0] == "AS KS QS JS TS\tTS JS QS KS AS\t7462"
+    print('OK')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--test':
+        test_evaluate_stream()
+    else:
+        logging.basicConfig(format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
+        sys.exit(1 if main() else 0)
@@ -26,7 +26,12 @@
 # Вам наверняка пригодится itertoolsю
 # Можно свободно определять свои функции и т.п.
 # -----------------
-from itertools import combinations, product
+import mmap
+import os
+import random
+import struct
+import sys
+from itertools import combinations, combinations_with_replacement, product
 
 PICTURE_RANKS = {
     'T': '10',
@@ -39,10 +44,430 @@ PICTURE_RANKS = {
 RANKS = ['2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K', 'A']
 BLACK_JOKER_VARIATIONS = [''.join(map(str, x)) for x in product(RANKS, ['C', 'S'])]
 RED_JOKER_VARIATIONS = [''.join(map(str, x)) for x in product(RANKS, ['H', 'D'])]
+SUITS = ['C', 'S', 'H', 'D']
+CARDS = [rank + suit for suit in SUITS for rank in RANKS]
+
+# Карта кодируется целым числом suit * 13 + rank (0..51), где rank - индекс в RANKS,
+# а suit - индекс в SUITS. "Рука" кодируется 52х битной маской: бит card установлен,
+# если карта есть в руке. Тогда 13 бит каждой масти - это маска рангов этой масти
+RANK_MASK = (1 << len(RANKS)) - 1
+CARD_INTS = {card: i for i, card in enumerate(CARDS)}
+CARD_RANK_BITS = [1 << (i % len(RANKS)) for i in range(len(CARDS))]
+CARD_SUITS = [i // len(RANKS) for i in range(len(CARDS))]
+POPCOUNT = [bin(mask).count('1') for mask in range(RANK_MASK + 1)]
+
+# Простые числа для рангов: произведение простых чисел пяти карт однозначно
+# определяет набор рангов руки независимо от порядка карт
+RANK_PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41]
+CARD_PRIMES = [RANK_PRIMES[i % len(RANKS)] for i in range(len(CARDS))]
+
+# Масти (индексы в SUITS), которые может заменить джокер
+JOKER_SUITS = {
+    '?B': (0, 1),
+    '?R': (2, 3),
+}
+
+
+def card_to_int(card):
+    """Переводит карту из строкового формата ('AS') в целое число"""
+    return CARD_INTS[card]
+
+
+def int_to_card(card):
+    """Переводит карту из целого числа в строковый формат"""
+    return CARDS[card]
+
+
+def hand_to_mask(hand):
+    """Переводит "руку" из списка строк в 52х битную маску"""
+    mask = 0
+    for card in hand:
+        mask |= 1 << CARD_INTS[card]
+    return mask
+
+
+def mask_to_hand(mask):
+    """Переводит 52х битную маску в список карт в строковом формате"""
+    hand = []
+    while mask:
+        low = mask & -mask
+        hand.append(CARDS[low.bit_length() - 1])
+        mask ^= low
+    return hand
+
+
+def _hand_rank_tuple(ranks, is_flush):
+    """Эталонный ранг 'руки' по индексам рангов пяти карт в формате hand_rank"""
+    values = sorted([rank + 2 for rank in ranks], reverse=True)
+    groups = sorted(((values.count(v), v) for v in set(values)), reverse=True)
+    counts = [count for count, _ in groups]
+    high = None
+    if counts == [1, 1, 1, 1, 1]:
+        if values[0] - values[4] == 4:
+            high = values[0]
+        elif values == [14, 5, 4, 3, 2]:
+            high = 5
+    if high and is_flush:
+        return (8, high)
+    elif counts[0] == 4:
+        return (7, groups[0][1], groups[1][1])
+    elif counts[:2] == [3, 2]:
+        return (6, groups[0][1], groups[1][1])
+    elif is_flush:
+        return (5, values)
+    elif high:
+        return (4, high)
+    elif counts[0] == 3:
+        return (3, groups[0][1], values)
+    elif counts[:2] == [2, 2]:
+        return (2, (groups[0][1], groups[1][1]), values)
+    elif counts[0] == 2:
+        return (1, groups[0][1], values)
+    else:
+        return (0, values)
+
+
+def _freeze(rank_tuple):
+    return tuple(tuple(x) if isinstance(x, list) else x for x in rank_tuple)
+
+
+def _build_tables():
+    """Строит таблицы силы для всех 7462 классов рук из 5ти карт.
+    Сила - целое число от 1 до 7462, чем больше, тем сильнее рука.
+    Последний элемент результата - для каждой силы ранги и признак флеша одной из рук этого класса"""
+    rank_tuples = {}
+    representatives = {}
+    nonflush = {}
+    for ranks in combinations_with_replacement(range(len(RANKS)), 5):
+        if max(ranks.count(r) for r in ranks) > 4:
+            continue
+        key = 1
+        for rank in ranks:
+            key *= RANK_PRIMES[rank]
+        rank_tuple = _hand_rank_tuple(ranks, False)
+        nonflush[key] = _freeze(rank_tuple)
+        rank_tuples[nonflush[key]] = rank_tuple
+        representatives[nonflush[key]] = (ranks, False)
+    flush = {}
+    for ranks in combinations(range(len(RANKS)), 5):
+        rank_tuple = _hand_rank_tuple(ranks, True)
+        mask = sum(1 << rank for rank in ranks)
+        flush[mask] = _freeze(rank_tuple)
+        rank_tuples[flush[mask]] = rank_tuple
+        representatives[flush[mask]] = (ranks, True)
+    classes = sorted(rank_tuples)
+    strengths = {rank_tuple: i + 1 for i, rank_tuple in enumerate(classes)}
+    flush_table = [0] * (1 << len(RANKS))
+    for mask, rank_tuple in flush.items():
+        flush_table[mask] = strengths[rank_tuple]
+    prime_table = {key: strengths[rank_tuple] for key, rank_tuple in nonflush.items()}
+    return (prime_table, flush_table, [None] + [rank_tuples[rank_tuple] for rank_tuple in classes],
+            [None] + [representatives[rank_tuple] for rank_tuple in classes])
+
+
+# Маски рангов всех стритов от старшего к младшему (A-K-Q-J-T ... 5-4-3-2-A)
+STRAIGHTS = [0b11111 << low for low in range(len(RANKS) - 5, -1, -1)] + [(1 << 12) | 0b1111]
+
+
+def _build_straight_table(straights=STRAIGHTS):
+    """Для каждой 13ти битной маски рангов - маска старшего стрита в ней или 0"""
+    table = [0] * (1 << len(RANKS))
+    for mask in range(len(table)):
+        for straight_mask in straights:
+            if mask & straight_mask == straight_mask:
+                table[mask] = straight_mask
+                break
+    return table
+
+
+# Файл с заранее построенными таблицами (генерируется утилитой tables.py): заголовок TABLES_HEADER
+# (сигнатура, версия, размер таблиц флешей и стритов, число произведений простых чисел, число сил,
+# число записей в таблицах замен для одного и двух джокеров), затем массивы little-endian:
+# произведения простых чисел (uint32) основной таблицы и таблиц замен, таблица флешей, таблица стритов,
+# силы для произведений простых чисел, таблицы дополнения флешей одним и двумя джокерами (uint16),
+# по TABLES_RANK_RECORD байт на каждую силу (признак флеша и ранги пяти карт одной из рук этого класса)
+# и ранги замен джокеров (uint8, по 4 бита на джокера)
+TABLES_MAGIC = b'PKRTABLE'
+TABLES_VERSION = 2
+TABLES_HEADER = struct.Struct('<8sIIIIII')
+TABLES_RANK_RECORD = 6
+TABLES_PATH = os.environ.get('POKER_TABLES', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                          'poker_tables.bin'))
+# Число джокеров, для которого в файле таблиц есть готовые замены
+TABLE_JOKERS = (1, 2)
+
+
+class _HandRankTable(object):
+    """Таблица STRENGTH_HAND_RANKS поверх файла таблиц: кортеж hand_rank строится при первом обращении.
+    Как и в построенной таблице, элемент 0 - None, записи файла соответствуют силам от 1"""
+
+    def __init__(self, records):
+        self.records = records
+        self.cache = {0: None}
+
+    def __len__(self):
+        return len(self.records) // TABLES_RANK_RECORD + 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = range(len(self))[index]
+        if index not in self.cache:
+            record = self.records[(index - 1) * TABLES_RANK_RECORD:index * TABLES_RANK_RECORD]
+            self.cache[index] = _hand_rank_tuple(list(record[1:]), bool(record[0]))
+        return self.cache[index]
+
+
+def load_tables(path=TABLES_PATH):
+    """Отображает файл таблиц в память. Таблицы флешей и стритов используются без копирования,
+    поэтому процессы, загрузившие один файл, разделяют одни и те же страницы памяти.
+    Возвращает (PRIME_PRODUCT_STRENGTH, FLUSH_STRENGTH, STRAIGHT_MASK, STRENGTH_HAND_RANKS,
+    WILD_RANKS, WILD_FLUSH_FILL) или None, если файла нет, он другой версии
+    или порядок байт платформы не little-endian"""
+    if sys.byteorder != 'little':
+        return None
+    try:
+        with open(path, 'rb') as f:
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    except (OSError, ValueError):
+        return None
+    if len(data) < TABLES_HEADER.size:
+        return None
+    magic, version, table_size, primes_count, strengths_count, *wild_counts = TABLES_HEADER.unpack_from(data)
+    offsets = [TABLES_HEADER.size]
+    for size in (4 * primes_count, *(4 * count for count in wild_counts), 2 * table_size, 2 * table_size,
+                 2 * primes_count, *(2 * table_size for _ in TABLE_JOKERS), TABLES_RANK_RECORD * strengths_count,
+                 *wild_counts):
+        offsets.append(offsets[-1] + size)
+    if (magic, version, table_size) != (TABLES_MAGIC, TABLES_VERSION, RANK_MASK + 1) or len(data) != offsets[-1]:
+        return None
+    (keys, wild_keys1, wild_keys2, flush, straight, values, fill1, fill2, records, wild_ranks1,
+     wild_ranks2) = (data[start:end] for start, end in zip(offsets, offsets[1:]))
+    return (dict(zip(keys.cast('I'), values.cast('H'))), flush.cast('H'), straight.cast('H'), _HandRankTable(records),
+            {1: dict(zip(wild_keys1.cast('I'), wild_ranks1)), 2: dict(zip(wild_keys2.cast('I'), wild_ranks2))},
+            {1: fill1.cast('H'), 2: fill2.cast('H')})
+
+
+_TABLES = load_tables()
+if _TABLES is None:
+    PRIME_PRODUCT_STRENGTH, FLUSH_STRENGTH, STRENGTH_HAND_RANKS, _ = _build_tables()
+    STRAIGHT_MASK = _build_straight_table()
+    # Таблицы замен джокеров строятся только утилитой tables.py, без них джокеры подбираются перебором кандидатов
+    WILD_RANKS = WILD_FLUSH_FILL = None
+else:
+    PRIME_PRODUCT_STRENGTH, FLUSH_STRENGTH, STRAIGHT_MASK, STRENGTH_HAND_RANKS, WILD_RANKS, WILD_FLUSH_FILL = _TABLES
+
+
+def strength5(cards):
+    """Возвращает силу "руки" из 5ти карт в целочисленном представлении"""
+    c1, c2, c3, c4, c5 = cards
+    if CARD_SUITS[c1] == CARD_SUITS[c2] == CARD_SUITS[c3] == CARD_SUITS[c4] == CARD_SUITS[c5]:
+        return FLUSH_STRENGTH[CARD_RANK_BITS[c1] | CARD_RANK_BITS[c2] | CARD_RANK_BITS[c3] |
+                              CARD_RANK_BITS[c4] | CARD_RANK_BITS[c5]]
+    return PRIME_PRODUCT_STRENGTH[CARD_PRIMES[c1] * CARD_PRIMES[c2] * CARD_PRIMES[c3] *
+                                  CARD_PRIMES[c4] * CARD_PRIMES[c5]]
+
+
+def hand_strength(hand):
+    """Возвращает силу 'руки' из 5ти карт в виде одного целого числа:
+    сильнейшей руке соответствует большее число"""
+    return strength5([CARD_INTS[card] for card in hand])
+
+
+def _top_bits(mask, n):
+    """Оставляет в маске не более n старших бит"""
+    while POPCOUNT[mask] > n:
+        mask &= mask - 1
+    return mask
+
+
+def _top_bit(mask):
+    return 1 << (mask.bit_length() - 1) if mask else 0
+
+
+def _rank_product(mask, n):
+    """Произведение простых чисел рангов маски, каждый ранг взят n раз"""
+    product = 1
+    while mask:
+        low = mask & -mask
+        product *= RANK_PRIMES[low.bit_length() - 1] ** n
+        mask ^= low
+    return product
+
+
+def rank_groups(mask):
+    """Раскладывает 52х битную маску на маски рангов: (маски мастей, все ранги, каре, тройки, пары)"""
+    suits = (mask & RANK_MASK, (mask >> 13) & RANK_MASK, (mask >> 26) & RANK_MASK, (mask >> 39) & RANK_MASK)
+    # Побитово складываем маски мастей: ones, twos, fours - разряды количества карт каждого ранга
+    ones = twos = fours = 0
+    for suited in suits:
+        carry = ones & suited
+        ones ^= suited
+        fours |= twos & carry
+        twos ^= carry
+    return suits, suits[0] | suits[1] | suits[2] | suits[3], fours, ones & twos, twos & ~ones
+
+
+def evaluate_mask(mask):
+    """Оценивает "руку" из 5ти и более карт, заданную 52х битной маской, без перебора сочетаний.
+    Возвращает пару (сила лучшей руки из 5ти карт, маска этих 5ти карт)"""
+    suits, ranks, fours, trips, pairs = rank_groups(mask)
+    if fours:
+        quad = _top_bit(fours)
+        groups = ((quad, 4), (_top_bit(ranks ^ quad), 1))
+    elif trips and (trips & (trips - 1) or pairs):
+        trip = _top_bit(trips)
+        groups = ((trip, 3), (_top_bit((trips ^ trip) | pairs), 2))
+    elif STRAIGHT_MASK[ranks]:
+        groups = ((STRAIGHT_MASK[ranks], 1),)
+    elif trips:
+        groups = ((trips, 3), (_top_bits(ranks ^ trips, 2), 1))
+    elif pairs & (pairs - 1):
+        pairs = _top_bits(pairs, 2)
+        groups = ((pairs, 2), (_top_bit(ranks ^ pairs), 1))
+    elif pairs:
+        groups = ((pairs, 2), (_top_bits(ranks ^ pairs, 3), 1))
+    else:
+        groups = ((_top_bits(ranks, 5), 1),)
+    key = 1
+    best_mask = 0
+    for group, n in groups:
+        key *= _rank_product(group, n)
+        while group:
+            low = group & -group
+            taken = 0
+            for suit, suited in enumerate(suits):
+                if suited & low and taken < n:
+                    best_mask |= low << (13 * suit)
+                    taken += 1
+            group ^= low
+    best = (PRIME_PRODUCT_STRENGTH[key], best_mask)
+    for suit, suited in enumerate(suits):
+        if POPCOUNT[suited] >= 5:
+            flush = STRAIGHT_MASK[suited] or _top_bits(suited, 5)
+            best = max(best, (FLUSH_STRENGTH[flush], flush << (13 * suit)))
+    return best
+
+
+def evaluate_hand(hand):
+    """Оценивает "руку" из 5ти и более карт без перебора сочетаний.
+    Возвращает пару (сила лучшей руки из 5ти карт, эти 5 карт)"""
+    strength, best_mask = evaluate_mask(hand_to_mask(hand))
+    return strength, tuple(mask_to_hand(best_mask))
+
+
+def rank_strength(ranks, fours, trips, pairs):
+    """Сила лучшей руки из 5ти и более карт без учета мастей (флешей) по маскам рангов rank_groups"""
+    if fours:
+        quad = _top_bit(fours)
+        key = _rank_product(quad, 4) * _rank_product(_top_bit(ranks ^ quad), 1)
+    elif trips and (trips & (trips - 1) or pairs):
+        trip = _top_bit(trips)
+        key = _rank_product(trip, 3) * _rank_product(_top_bit((trips ^ trip) | pairs), 2)
+    elif STRAIGHT_MASK[ranks]:
+        key = _rank_product(STRAIGHT_MASK[ranks], 1)
+    elif trips:
+        key = _rank_product(trips, 3) * _rank_product(_top_bits(ranks ^ trips, 2), 1)
+    elif pairs & (pairs - 1):
+        pairs = _top_bits(pairs, 2)
+        key = _rank_product(pairs, 2) * _rank_product(_top_bit(ranks ^ pairs), 1)
+    elif pairs:
+        key = _rank_product(pairs, 2) * _rank_product(_top_bits(ranks ^ pairs, 3), 1)
+    else:
+        key = _rank_product(_top_bits(ranks, 5), 1)
+    return PRIME_PRODUCT_STRENGTH[key]
+
+
+# Категории рук в формате первого элемента hand_rank
+(HIGH_CARD, PAIR, TWO_PAIR, TRIPS, STRAIGHT, FLUSH, FULL_HOUSE, QUADS, STRAIGHT_FLUSH) = range(9)
+
+
+class IncrementalHand(object):
+    """Рука, к которой по одной добавляются и из которой удаляются карты (например, по улицам раздачи).
+    Хранит маски мастей и маски рангов по количеству карт, поэтому add и remove выполняются
+    за постоянное время, а сила и категория вычисляются по ним без разбора всей руки заново"""
+    __slots__ = ('mask', 'suits', 'counts', 'by_count', '_strength')
+
+    def __init__(self, hand=()):
+        self.mask = 0
+        self.suits = [0] * len(SUITS)
+        self.counts = [0] * len(RANKS)
+        # by_count[n] - маска рангов, которых в руке ровно n карт
+        self.by_count = [RANK_MASK, 0, 0, 0, 0]
+        self._strength = None
+        for card in hand:
+            self.add(card)
+
+    def __len__(self):
+        return POPCOUNT[self.by_count[1]] + 2 * POPCOUNT[self.by_count[2]] + \
+            3 * POPCOUNT[self.by_count[3]] + 4 * POPCOUNT[self.by_count[4]]
+
+    def _move(self, card, delta):
+        card = CARD_INTS[card] if isinstance(card, str) else card
+        card_bit = 1 << card
+        if bool(self.mask & card_bit) == (delta > 0):
+            raise ValueError('Card %s is %s the hand' % (CARDS[card], 'already in' if delta > 0 else 'not in'))
+        rank_bit = CARD_RANK_BITS[card]
+        rank = card % len(RANKS)
+        count = self.counts[rank]
+        self.by_count[count] ^= rank_bit
+        self.by_count[count + delta] ^= rank_bit
+        self.counts[rank] = count + delta
+        self.suits[CARD_SUITS[card]] ^= rank_bit
+        self.mask ^= card_bit
+        self._strength = None
+
+    def add(self, card):
+        """Добавляет карту (в строковом формате или целым числом)"""
+        self._move(card, 1)
+
+    def remove(self, card):
+        """Удаляет карту из руки"""
+        self._move(card, -1)
+
+    def category(self):
+        """Категория лучшей руки из имеющихся карт (для руки меньше 5ти карт - по парам, тройкам и каре)"""
+        _, pairs, trips, fours = self.by_count[1:]
+        if len(self) >= 5:
+            return STRENGTH_HAND_RANKS[self.strength()][0]
+        if fours:
+            return QUADS
+        if trips:
+            return TRIPS
+        if pairs & (pairs - 1):
+            return TWO_PAIR
+        return PAIR if pairs else HIGH_CARD
+
+    def strength(self):
+        """Сила лучшей руки из 5ти карт, вычисляется один раз после каждого изменения руки"""
+        if self._strength is None:
+            if len(self) < 5:
+                raise ValueError('Hand must contain at least 5 cards')
+            ranks, pairs, trips, fours = self.by_count[1:]
+            strength = rank_strength(ranks | pairs | trips | fours, fours, trips, pairs)
+            for suited in self.suits:
+                if POPCOUNT[suited] >= 5:
+                    strength = max(strength, FLUSH_STRENGTH[STRAIGHT_MASK[suited] or _top_bits(suited, 5)])
+            self._strength = strength
+        return self._strength
+
+    def best_hand(self):
+        """Лучшие 5 карт руки в строковом формате"""
+        return tuple(mask_to_hand(evaluate_mask(self.mask)[1]))
+
+
+def strength_to_hand_rank(strength):
+    """Переводит силу 'руки' в значение в формате hand_rank"""
+    return tuple(list(x) if isinstance(x, list) else x for x in STRENGTH_HAND_RANKS[strength])
 
 
 def hand_rank(hand):
     """Возвращает значение определяющее ранг 'руки'"""
+    return strength_to_hand_rank(hand_strength(hand))
+
+
+def reference_hand_rank(hand):
+    """Исходная реализация hand_rank без таблиц"""
     ranks = card_ranks(hand)
     if straight(ranks) and flush(hand):
         return (8, max(ranks))
@@ -101,29 +526,163 @@ def two_pair(ranks):
 
 def best_hand(hand):
     """Из "руки" в 7 карт возвращает лучшую "руку" в 5 карт """
-    best_comb = sorted([(*hand_rank(x), x) for x in list(combinations(hand, 5))], reverse=True)
-    return best_comb[0][-1]
+    return evaluate_hand(hand)[1]
+
+
+def _bits(mask):
+    """Раскладывает маску на отдельные биты"""
+    bits = []
+    while mask:
+        low = mask & -mask
+        bits.append(low)
+        mask ^= low
+    return bits
+
+
+def _wild_rank_candidates(ranks, jokers_count):
+    """Ранги, которыми имеет смысл заменять джокеров вне флеша: уже имеющиеся ранги (сеты),
+    недостающие ранги стритов, которые джокеры могут собрать, и старшие отсутствующие ранги (кикеры)"""
+    candidates = ranks | _top_bits(RANK_MASK & ~ranks, jokers_count)
+    for straight_mask in STRAIGHTS:
+        if POPCOUNT[ranks & straight_mask] + jokers_count >= 5:
+            candidates |= straight_mask & ~ranks
+    return _bits(candidates)
+
+
+def _best_flush_fill(suited, allowed):
+    """Маска рангов, которыми allowed джокеров лучше всего дополняют до флеша масть с рангами suited,
+    или 0, если флеш не собрать"""
+    if POPCOUNT[suited] + allowed < 5 or POPCOUNT[suited] + allowed > len(RANKS):
+        return 0
+    best = (0, 0)
+    for added in combinations(_bits(RANK_MASK & ~suited), allowed):
+        flush_mask = suited | sum(added)
+        best = max(best, (FLUSH_STRENGTH[STRAIGHT_MASK[flush_mask] or _top_bits(flush_mask, 5)], sum(added)))
+    return best[1]
+
+
+def _place_jokers(mask, rank_bits, jokers):
+    """Маска карт с джокерами, замененными картами рангов rank_bits любой свободной допустимой масти,
+    или 0, если для какого-то джокера свободной карты нужного ранга нет"""
+    for rank_bit, suits in zip(rank_bits, jokers):
+        for suit in suits:
+            card_bit = rank_bit << (13 * suit)
+            if not mask & card_bit:
+                mask |= card_bit
+                break
+        else:
+            return 0
+    return mask
+
+
+def _flush_fills(best, suits, jokers, fill):
+    """Улучшает best флешами: джокеры подходящего цвета становятся недостающими картами одной масти.
+    fill(suited, allowed) возвращает лучшие добавленные ранги"""
+    for suit, suited in enumerate(suits):
+        allowed = sum(1 for joker_suits in jokers if suit in joker_suits)
+        added = allowed and fill(suited, allowed)
+        if added:
+            flush = STRAIGHT_MASK[suited | added] or _top_bits(suited | added, 5)
+            best = max(best, (FLUSH_STRENGTH[flush], flush << (13 * suit)))
+    return best
+
+
+def _evaluate_wild_table(mask, jokers):
+    """evaluate_wild_mask по таблицам замен из файла таблиц: ранги замен берутся из WILD_RANKS
+    по произведению простых чисел рангов обычных карт, флеши дополняются по WILD_FLUSH_FILL.
+    Возвращает None, если руки нет в таблицах или у джокера нет свободной карты нужного ранга"""
+    suits, ranks, fours, trips, pairs = rank_groups(mask)
+    key = _rank_product(ranks, 1) * _rank_product(pairs | trips | fours, 1) * _rank_product(trips | fours, 1) * \
+        _rank_product(fours, 1)
+    choice = WILD_RANKS[len(jokers)].get(key)
+    if choice is None:
+        return None
+    rank_bits = [1 << (choice >> (4 * i) & 0xF) for i in range(len(jokers))]
+    extended = _place_jokers(mask, rank_bits, jokers) or _place_jokers(mask, rank_bits[::-1], jokers)
+    if not extended:
+        return None
+    return _flush_fills(evaluate_mask(extended), suits, jokers,
+                        lambda suited, allowed: WILD_FLUSH_FILL[allowed][suited])
+
+
+def evaluate_wild_mask(mask, jokers):
+    """Оценивает "руку", заданную маской обычных карт и списком джокеров
+    (для каждого джокера - кортеж мастей, которые он может заменить).
+    Возвращает пару (сила лучшей руки из 5ти карт, маска этих 5ти карт с учетом замен)"""
+    if not jokers:
+        return evaluate_mask(mask)
+    if WILD_RANKS is not None and len(jokers) in TABLE_JOKERS:
+        best = _evaluate_wild_table(mask, jokers)
+        if best is not None:
+            return best
+    suits = [(mask >> (13 * suit)) & RANK_MASK for suit in range(len(SUITS))]
+    best = _flush_fills((0, 0), suits, jokers, _best_flush_fill)
+    # Остальные комбинации зависят только от рангов: масть замены - любая свободная из допустимых
+    ranks = suits[0] | suits[1] | suits[2] | suits[3]
+    for chosen in product(_wild_rank_candidates(ranks, len(jokers)), repeat=len(jokers)):
+        extended = _place_jokers(mask, chosen, jokers)
+        if extended:
+            best = max(best, evaluate_mask(extended))
+    return best
+
+
+def _count_groups(counts):
+    """Маски рангов (все ранги, каре, тройки, пары) по количеству карт каждого ранга"""
+    groups = [0] * 5
+    for rank, count in enumerate(counts):
+        groups[count] |= 1 << rank
+    return groups[1] | groups[2] | groups[3] | groups[4], groups[4], groups[3], groups[2]
+
+
+def _build_wild_tables():
+    """Строит таблицы для джокеров в руках из 5-7 карт (вместе с джокерами), используется утилитой tables.py.
+    Возвращает пару словарей по числу джокеров из TABLE_JOKERS:
+    {произведение простых чисел рангов обычных карт: лучшие ранги замен по 4 бита на джокера}
+    и список лучших дополнений флеша для каждой маски рангов масти (_best_flush_fill)"""
+    wild_ranks = {}
+    wild_fill = {}
+    for jokers in TABLE_JOKERS:
+        table = {}
+        for size in range(5 - jokers, 8 - jokers):
+            for ranks in combinations_with_replacement(range(len(RANKS)), size):
+                counts = [ranks.count(rank) for rank in range(len(RANKS))]
+                if max(counts) > 4:
+                    continue
+                best = (0, ())
+                for chosen in combinations_with_replacement(_wild_rank_candidates(_count_groups(counts)[0], jokers),
+                                                            jokers):
+                    extended = counts[:]
+                    for rank_bit in chosen:
+                        extended[rank_bit.bit_length() - 1] += 1
+                    if max(extended) <= 4:
+                        best = max(best, (rank_strength(*_count_groups(extended)), chosen))
+                key = 1
+                for rank in ranks:
+                    key *= RANK_PRIMES[rank]
+                table[key] = sum((rank_bit.bit_length() - 1) << (4 * i) for i, rank_bit in enumerate(best[1]))
+        wild_ranks[jokers] = table
+        wild_fill[jokers] = [_best_flush_fill(suited, jokers) for suited in range(RANK_MASK + 1)]
+    return wild_ranks, wild_fill
 
 
 def best_wild_hand(hand):
     """best_hand но с джокерами"""
-    additional_cards = set()
-    removed = 0
-    if '?B' in hand:
-        additional_cards = additional_cards.union(BLACK_JOKER_VARIATIONS)
-        hand.remove('?B')
-        removed += 1
-    if '?R' in hand:
-        additional_cards = additional_cards.union(RED_JOKER_VARIATIONS)
-        hand.remove('?R')
-        removed += 1
-    can_add_cards = set(additional_cards) - set(hand)
-    can_add_card_variations = list(combinations([*can_add_cards], removed))
-    combs = []
-    for ext in can_add_card_variations:
-        best = sorted([(*hand_rank(x), x) for x in list(combinations([*hand, *ext], 5))], reverse=True)[0]
-        combs.append((best[0], best[-1]))
-    return sorted(combs, reverse=True)[0][-1]
+    jokers = [JOKER_SUITS[card] for card in hand if card in JOKER_SUITS]
+    mask = hand_to_mask([card for card in hand if card not in JOKER_SUITS])
+    return tuple(mask_to_hand(evaluate_wild_mask(mask, jokers)[1]))
+
+
+def reference_best_wild_hand(hand):
+    """Перебор всех замен джокеров и всех сочетаний по 5 карт, используется для проверки best_wild_hand"""
+    cards = [card for card in hand if card not in JOKER_SUITS]
+    variations = [[CARDS[rank + 13 * suit] for suit in JOKER_SUITS[card] for rank in range(len(RANKS))]
+                  for card in hand if card in JOKER_SUITS]
+    best = None
+    for ext in product(*variations):
+        if len(set(ext)) < len(ext) or set(ext) & set(cards):
+            continue
+        best = max(best or (0, None), max((hand_strength(x), x) for x in combinations([*cards, *ext], 5)))
+    return best[-1]
 
 
 def test_best_hand():
@@ -137,6 +696,91 @@ def test_best_hand():
     print('OK')
 
 
+def test_hand_rank():
+    print("test_hand_rank...")
+    categories = [rank_tuple[0] for rank_tuple in STRENGTH_HAND_RANKS[1:]]
+    assert ([categories.count(category) for category in range(9)]
+            == [1277, 2860, 858, 858, 10, 1277, 156, 156, 10])
+    assert hand_rank("JC TC 9C 8C 7C".split()) == (8, 11)
+    assert hand_rank("5S 5H 5D 5C JS".split()) == (7, 5, 11)
+    assert hand_rank("TD TC TH 7C 7D".split()) == (6, 10, 7)
+    assert hand_rank("AD 3D 5D 7D 9D".split()) == (5, [14, 9, 7, 5, 3])
+    assert hand_rank("AD 2C 3H 4S 5D".split()) == (4, 5)
+    assert hand_rank("7D 7C 7H KS 2D".split()) == (3, 7, [13, 7, 7, 7, 2])
+    assert hand_rank("5D 5C JH JS 2D".split()) == (2, (11, 5), [11, 11, 5, 5, 2])
+    assert hand_rank("5D 5C JH 9S 2D".split()) == (1, 5, [11, 9, 5, 5, 2])
+    assert hand_rank("AD KC JH 9S 2D".split()) == (0, [14, 13, 11, 9, 2])
+    assert hand_strength("AD 2C 3H 4S 5D".split()) < hand_strength("2D 3C 4H 5S 6D".split())
+    assert hand_strength("AD AC KH KS 2D".split()) > hand_strength("KD KC QH QS AD".split())
+    for hand in combinations(CARDS[::3], 5):
+        assert hand_rank(hand) == _hand_rank_tuple([RANKS.index(c[0]) for c in hand], flush(hand))
+    print('OK')
+
+
+def test_evaluate_hand():
+    print("test_evaluate_hand...")
+    rnd = random.Random(7)
+    for n in (5, 6, 7, 8):
+        for _ in range(500):
+            hand = rnd.sample(CARDS, n)
+            strength, cards = evaluate_hand(hand)
+            assert strength == max(hand_strength(x) for x in combinations(hand, 5))
+            assert strength == hand_strength(cards) and set(cards) <= set(hand)
+    assert evaluate_hand("AD 2C 3H 4S 5D 9C 9S".split())[0] == hand_strength("AD 2C 3H 4S 5D".split())
+    print('OK')
+
+
+def test_card_encoding():
+    print("test_card_encoding...")
+    assert [int_to_card(card_to_int(card)) for card in CARDS] == CARDS
+    assert sorted(mask_to_hand(hand_to_mask("AS 2C TD".split()))) == ['2C', 'AS', 'TD']
+    assert hand_to_mask(CARDS) == (1 << 52) - 1
+    rnd = random.Random(11)
+    for _ in range(500):
+        cards = rnd.sample(range(52), 7)
+        mask = sum(1 << card for card in cards)
+        strength, best_mask = evaluate_mask(mask)
+        assert strength == max(strength5(x) for x in combinations(cards, 5))
+        assert POPCOUNT[best_mask & RANK_MASK] + POPCOUNT[best_mask >> 13 & RANK_MASK] + \
+            POPCOUNT[best_mask >> 26 & RANK_MASK] + POPCOUNT[best_mask >> 39] == 5
+        assert best_mask & mask == best_mask
+    print('OK')
+
+
+def test_incremental_hand():
+    print("test_incremental_hand...")
+    rnd = random.Random(13)
+    for _ in range(300):
+        cards = rnd.sample(range(52), 9)
+        hand = IncrementalHand(cards[:2])
+        assert hand.category() == (PAIR if cards[0] % 13 == cards[1] % 13 else HIGH_CARD)
+        for street in (cards[2:5], cards[5:6], cards[6:7]):
+            for card in street:
+                hand.add(card)
+            assert (hand.strength(), hand.mask) == (evaluate_mask(hand.mask)[0], sum(1 << c for c in cards[:len(hand)]))
+            assert hand.category() == strength_to_hand_rank(hand.strength())[0]
+        # Другой вариант ривера
+        hand.remove(cards[6])
+        hand.add(cards[7])
+        assert hand.strength() == evaluate_mask(sum(1 << c for c in cards[:6] + cards[7:8]))[0]
+    hand = IncrementalHand("TD TC 7H".split())
+    assert hand.category() == PAIR
+    hand.add('TS')
+    hand.add('7C')
+    assert len(hand) == 5 and hand.category() == FULL_HOUSE
+    assert sorted(hand.best_hand()) == ['7C', '7H', 'TC', 'TD', 'TS']
+    hand.remove('7H')
+    assert hand.category() == TRIPS
+    for wrong in (lambda: hand.add('TD'), lambda: hand.remove('AS'), hand.strength):
+        try:
+            wrong()
+        except ValueError:
+            pass
+        else:
+            assert False, 'Wrong operation with incremental hand completed without errors'
+    print('OK')
+
+
 def test_best_wild_hand():
     print("test_best_wild_hand...")
     assert (sorted(best_wild_hand("6C 7C 8C 9C TC 5C ?B".split()))
@@ -145,9 +789,22 @@ def test_best_wild_hand():
             == ['7C', 'TC', 'TD', 'TH', 'TS'])
     assert (sorted(best_wild_hand("JD TC TH 7C 7D 7S 7H".split()))
             == ['7C', '7D', '7H', '7S', 'JD'])
+    hand = "2C 3D 4H 8S ?R ?R".split()
+    assert sorted(best_wild_hand(hand)) == ['2C', '3D', '4H', '5H', '6H']
+    assert hand == "2C 3D 4H 8S ?R ?R".split()
+    assert hand_rank(best_wild_hand("2C 3D 4H 9S ?B ?R ?R".split())) == (7, 9, 4)
+    rnd = random.Random(3)
+    for jokers in (['?B'], ['?R'], ['?B', '?R'], ['?R', '?R']):
+        for _ in range(30):
+            hand = rnd.sample(CARDS, 7 - len(jokers)) + jokers
+            assert hand_strength(best_wild_hand(hand)) == hand_strength(reference_best_wild_hand(hand))
     print('OK')
 
 
 if __name__ == '__main__':
+    test_hand_rank()
+    test_evaluate_hand()
+    test_card_encoding()
+    test_incremental_hand()
     test_best_hand()
     test_best_wild_hand()
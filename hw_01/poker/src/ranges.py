@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Диапазоны рук и эквити диапазона против диапазона.
+# Диапазон записывается через запятую в привычной нотации:
+#   QQ+          - пары от дам и выше
+#   99-66        - пары от шестерок до девяток
+#   AKs, AKo, AK - одномастные, разномастные или любые туз-король
+#   ATs+         - одномастные туз-десятка, туз-валет, туз-дама и туз-король
+#   A5s-A2s      - одномастные туз-пятерка ... туз-двойка
+#   AsKs         - конкретная комбинация карт
+#   AKs:0.5      - комбинации с весом 0.5 (по умолчанию вес 1)
+# -----------------
+import re
+from collections import namedtuple
+from itertools import product
+from multiprocessing import Pool
+
+from equity import (BOARD_SIZE, DEFAULT_BATCH_SIZE, DEFAULT_MAX_SAMPLES, DEFAULT_PRECISION, EquityResult,
+                    PlayerEquity, exact_equity, holdem_strength, parse_cards, run_monte_carlo)
+from poker import CARDS, CARD_INTS, RANKS, SUITS, mask_to_hand
+
+TOKEN_REGEXP = re.compile(r'^([2-9TJQKA])([2-9TJQKA])([so]?)(\+?)$')
+RANGE_REGEXP = re.compile(r'^([2-9TJQKA])([2-9TJQKA])([so]?)-([2-9TJQKA])([2-9TJQKA])([so]?)$')
+COMBO_REGEXP = re.compile(r'^([2-9TJQKA][CSHD])([2-9TJQKA][CSHD])$')
+DEFAULT_CHUNK_SIZE = 16
+
+RangeEquity = namedtuple('RangeEquity', 'equity combos')
+
+
+def _rank_combos(high, low, kind):
+    """Маски комбинаций двух карт рангов high и low: kind - 's' одномастные, 'o' разномастные, '' любые"""
+    combos = []
+    for first, second in product(range(len(SUITS)), repeat=2):
+        if high == low and first >= second:
+            continue
+        if kind == 's' and first != second or kind == 'o' and first == second:
+            continue
+        combos.append(1 << (first * len(RANKS) + high) | 1 << (second * len(RANKS) + low))
+    return combos
+
+
+def _parse_token(token):
+    """Переводит один элемент диапазона (без веса) в список масок комбинаций"""
+    match = COMBO_REGEXP.match(token.upper())
+    if match:
+        first, second = match.groups()
+        if first == second:
+            raise ValueError('Wrong range token %s' % token)
+        return [1 << CARD_INTS[first] | 1 << CARD_INTS[second]]
+    match = TOKEN_REGEXP.match(token)
+    if match:
+        high, low, kind, plus = match.groups()
+        high, low = sorted((RANKS.index(high), RANKS.index(low)), reverse=True)
+        if high == low and kind:
+            raise ValueError('Pair can not be suited or offsuit in %s' % token)
+        if not plus:
+            pairs = [(high, low)]
+        elif high == low:
+            pairs = [(rank, rank) for rank in range(high, len(RANKS))]
+        else:
+            pairs = [(high, kicker) for kicker in range(low, high)]
+        return [combo for h, l in pairs for combo in _rank_combos(h, l, kind)]
+    match = RANGE_REGEXP.match(token)
+    if match:
+        high1, low1, kind1, high2, low2, kind2 = match.groups()
+        if kind1 != kind2:
+            raise ValueError('Wrong range token %s' % token)
+        if high1 == low1 and high2 == low2:
+            ranks = sorted((RANKS.index(high1), RANKS.index(high2)))
+            pairs = [(rank, rank) for rank in range(ranks[0], ranks[1] + 1)]
+        elif high1 == high2 and high1 != low1 and high2 != low2:
+            high = RANKS.index(high1)
+            kickers = sorted((RANKS.index(low1), RANKS.index(low2)))
+            if kickers[1] >= high:
+                raise ValueError('Wrong range token %s' % token)
+            pairs = [(high, kicker) for kicker in range(kickers[0], kickers[1] + 1)]
+        else:
+            raise ValueError('Wrong range token %s' % token)
+        return [combo for h, l in pairs for combo in _rank_combos(h, l, kind1)]
+    raise ValueError('Wrong range token %s' % token)
+
+
+def parse_range(text):
+    """Переводит диапазон в строковой нотации в словарь {маска комбинации: вес}"""
+    combos = {}
+    for token in text.replace(' ', '').split(','):
+        if not token:
+            continue
+        weight = 1.0
+        if ':' in token:
+            token, weight = token.split(':', 1)
+            weight = float(weight)
+            if weight < 0:
+                raise ValueError('Weight can not be negative in %s' % token)
+        for combo in _parse_token(token):
+            combos[combo] = weight
+    return combos
+
+
+def combo_to_hand(combo):
+    """Переводит маску комбинации в список карт в строковом формате"""
+    return mask_to_hand(combo)
+
+
+def _player_combos(player_range, blocked):
+    """Комбинации диапазона без карт, уже занятых на столе, и их веса"""
+    combos = parse_range(player_range) if isinstance(player_range, str) else player_range
+    return [(combo, weight) for combo, weight in combos.items() if weight > 0 and not combo & blocked]
+
+
+def _exact_chunk(task):
+    """Точное эквити для порции сочетаний комбинаций. Выполняется в процессе пула"""
+    matchups, board, dead, evaluator, board_size = task
+    sums = [[0.0, 0.0, 0.0] for _ in matchups[0][0]]
+    total = 0.0
+    for holes, weight in matchups:
+        result = exact_equity([mask_to_hand(hole) for hole in holes], board, dead, evaluator, board_size)
+        for i, player in enumerate(result.players):
+            sums[i][0] += player.win * weight
+            sums[i][1] += player.tie * weight
+            sums[i][2] += player.equity * weight
+        total += weight
+    return sums, total
+
+
+def exact_range_equity(ranges, board=(), dead=(), processes=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                       evaluator=holdem_strength, board_size=BOARD_SIZE):
+    """Точное эквити диапазонов: перебираются все сочетания комбинаций игроков без общих карт,
+    каждое оценивается exact_equity с весом, равным произведению весов комбинаций.
+    Сочетания делятся на порции по chunk_size и оцениваются в пуле процессов"""
+    blocked = parse_cards(board) | parse_cards(dead)
+    players = [_player_combos(player_range, blocked) for player_range in ranges]
+    matchups = []
+    for chosen in product(*players):
+        used = 0
+        weight = 1.0
+        for combo, combo_weight in chosen:
+            if combo & used:
+                break
+            used |= combo
+            weight *= combo_weight
+        else:
+            matchups.append(([combo for combo, _ in chosen], weight))
+    if not matchups:
+        raise ValueError('Player ranges do not have non-overlapping combinations')
+    tasks = [(matchups[i:i + chunk_size], board, dead, evaluator, board_size)
+             for i in range(0, len(matchups), chunk_size)]
+    pool = Pool(processes) if processes != 1 else None
+    try:
+        chunks = pool.map(_exact_chunk, tasks) if pool else list(map(_exact_chunk, tasks))
+    finally:
+        if pool:
+            pool.terminate()
+    total = sum(chunk_total for _, chunk_total in chunks)
+    result = []
+    for i in range(len(ranges)):
+        win, tie, equity = (sum(sums[i][j] for sums, _ in chunks) / total for j in range(3))
+        result.append(PlayerEquity(win, tie, equity, (equity, equity)))
+    return RangeEquity(EquityResult(result, len(matchups), True), [len(combos) for combos in players])
+
+
+def range_equity(ranges, board=(), dead=(), precision=DEFAULT_PRECISION, max_samples=DEFAULT_MAX_SAMPLES,
+                 batch_size=DEFAULT_BATCH_SIZE, processes=None, seed=0, evaluator=holdem_strength,
+                 board_size=BOARD_SIZE):
+    """Эквити диапазонов методом Монте-Карло: в каждой раздаче комбинации игроков выбираются
+    из диапазонов с учетом весов, раздачи с пересекающимися картами отбрасываются"""
+    blocked = parse_cards(board) | parse_cards(dead)
+    players = [_player_combos(player_range, blocked) for player_range in ranges]
+    if len(players) < 2:
+        raise ValueError('At least two players are required')
+    if not all(players):
+        raise ValueError('Some player ranges are empty')
+    player_ranges = []
+    for combos in players:
+        cum_weights = []
+        total = 0.0
+        for _, weight in combos:
+            total += weight
+            cum_weights.append(total)
+        player_ranges.append(([combo for combo, _ in combos], cum_weights))
+    # Карты игроков с единственной комбинацией известны заранее и не раздаются на борд:
+    # run_monte_carlo учитывает в запасе колоды только карты игроков с несколькими комбинациями
+    for combos in players:
+        if len(combos) == 1:
+            blocked |= combos[0][0]
+    deck = [card for card in range(len(CARDS)) if not blocked >> card & 1]
+    board_mask = parse_cards(board)
+    result = run_monte_carlo(player_ranges, board_mask, deck, board_size - bin(board_mask).count('1'), precision,
+                             max_samples, batch_size, processes, seed, evaluator)
+    return RangeEquity(result, [len(combos) for combos in players])
+
+
+def test_parse_range():
+    print("test_parse_range...")
+    assert len(parse_range("QQ+")) == 18
+    assert len(parse_range("AKs")) == 4
+    assert len(parse_range("AKo")) == 12
+    assert len(parse_range("AK")) == 16
+    assert len(parse_range("72o")) == 12
+    assert len(parse_range("A5s-A2s")) == 16
+    assert len(parse_range("99-66")) == 24
+    assert len(parse_range("ATs+")) == 16
+    assert len(parse_range("QQ+, AKs, A5s-A2s, 72o")) == 50
+    assert parse_range("AsKs") == {1 << CARD_INTS['AS'] | 1 << CARD_INTS['KS']: 1.0}
+    assert sorted(sorted(combo_to_hand(combo)) for combo in parse_range("AKs")) == [
+        ['AC', 'KC'], ['AD', 'KD'], ['AH', 'KH'], ['AS', 'KS']]
+    assert set(parse_range("QQ+, AKs:0.5").values()) == {1.0, 0.5}
+    for wrong in ("AAs", "A5s-K2s", "XX", "AsAs", "A5s-A2o"):
+        try:
+            parse_range(wrong)
+        except ValueError:
+            pass
+        else:
+            assert False, 'Wrong range %s parsed without errors' % wrong
+    print('OK')
+
+
+def test_range_equity():
+    print("test_range_equity...")
+    board = "2C 7D 9H"
+    result = exact_range_equity(["AA", "KK, QQ:0.5"], board=board, processes=1)
+    assert result.combos == [6, 12]
+    expected = [0.0, 0.0]
+    total = 0.0
+    for first, second in product(parse_range("AA"), parse_range("KK, QQ:0.5").items()):
+        weight = second[1]
+        players = [mask_to_hand(first), mask_to_hand(second[0])]
+        for i, player in enumerate(exact_equity(players, board=board).players):
+            expected[i] += player.equity * weight
+        total += weight
+    assert [round(player.equity, 9) for player in result.equity.players] == [round(e / total, 9) for e in expected]
+
+    # Блокеры: на борде туз, поэтому у первого игрока остается три комбинации тузов
+    result = exact_range_equity(["AA", "AKs"], board="AC 7D 2H 3S 9S", processes=2)
+    assert result.combos == [3, 3] and result.equity.players[0].equity == 1.0
+
+    # Конкретная рука против диапазона совпадает с точным перебором в пределах точности
+    for ranges in (["AsKs", "QQ"], ["AsKs", "QsQh"]):
+        expected = exact_range_equity(ranges, board=board, processes=1).equity.players[0].equity
+        result = range_equity(ranges, board=board, precision=0.005, processes=1)
+        assert abs(result.equity.players[0].equity - expected) < 0.015
+
+    result = range_equity(["QQ+, AKs", "72o"], precision=0.01, processes=1)
+    assert 0.8 < result.equity.players[0].equity < 0.95
+    try:
+        range_equity(["AsKs", "AsKs"], processes=1)
+    except ValueError:
+        pass
+    else:
+        assert False, 'Overlapping ranges processed without errors'
+    print('OK')
+
+
+if __name__ == '__main__':
+    test_parse_range()
+    test_range_equity()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Разбор истории раздач и статистика игроков.
+# История - текстовый файл, раздачи в котором разделены пустыми строками:
+#   Hand 42                    - номер раздачи
+#   alice AS AH 100            - игрок, его карманные карты и вклад в банк;
+#   bob KC KD 100                вместо карт '-', если игрок сбросил карты,
+#   carol - 10                   и '?', если карты не показаны (только у единственного
+#                                оставшегося в раздаче игрока)
+#   Allin 2C 7D 9H             - общие карты на момент, когда все фишки оказались в банке
+#                                (строки нет, если олл-ина не было; пустой список - олл-ин до флопа)
+#   Board 2C 7D 9H JS 3C       - общие карты в конце раздачи
+# Карты записываются в нотации poker.py. Банки делятся функцией showdown.resolve_masks.
+# Для олл-инов считается эквити выигрыша в фишках (all-in EV): средний выигрыш
+# по всем (до двух недостающих общих карт) или случайным (samples) вариантам доски.
+# Раздачи читаются порциями, порции разбираются и оцениваются в пуле процессов,
+# по каждой порции возвращается только сводная статистика, поэтому расход памяти
+# не зависит от размера истории.
+#
+# Запуск: python3 replay.py [--processes N] [--chunk-size N] [--samples N] [файл ...]
+# -----------------
+import logging
+import optparse
+import random
+import sys
+from collections import namedtuple
+from itertools import combinations, islice
+
+from equity import BOARD_SIZE, holdem_strength, parse_cards
+from evaluate import imap_bounded, open_inputs
+from poker import CARDS
+from showdown import award_pots, build_pots, resolve_masks
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_SAMPLES = 1000
+# Сколько недостающих общих карт перебирается полностью, при большем числе доски выбираются случайно
+MAX_EXACT_MISSING = 2
+FOLDED = '-'
+HIDDEN = '?'
+
+HandRecord = namedtuple('HandRecord', 'hand_id names holes contributions allin_board board')
+# Поля статистики игрока
+STATS_FIELDS = ('hands', 'showdowns', 'won', 'net', 'allins', 'allin_ev', 'allin_net')
+PlayerStats = namedtuple('PlayerStats', STATS_FIELDS)
+
+
+def get_options(args=None):
+    parser = optparse.OptionParser('usage: %prog [--processes N] [--chunk-size N] [--samples N] [file ...]')
+    parser.add_option('--processes', dest='processes', type='int', default=None,
+                      help='number of worker processes, 1 replays hands in the current process')
+    parser.add_option('--chunk-size', dest='chunk_size', type='int', default=DEFAULT_CHUNK_SIZE,
+                      help='number of hands sent to a worker at once')
+    parser.add_option('--samples', dest='samples', type='int', default=DEFAULT_SAMPLES,
+                      help='random boards for all-in EV when more than %d board cards are missing'
+                      % MAX_EXACT_MISSING)
+    (options, args) = parser.parse_args(args)
+    for name in ('processes', 'chunk_size', 'samples'):
+        value = getattr(options, name)
+        if value is not None and value < 1:
+            parser.error('--%s must be positive' % name.replace('_', '-'))
+    return options, args
+
+
+def read_hands(files):
+    """Генератор раздач из файлов: каждая раздача - список непустых строк"""
+    for f in files:
+        lines = []
+        for line in f:
+            line = line.strip()
+            if line.startswith('Hand ') and lines:
+                yield lines
+                lines = []
+            if line:
+                lines.append(line)
+            elif lines:
+                yield lines
+                lines = []
+        if lines:
+            yield lines
+
+
+def _check_cards(hand_id, used, cards):
+    """Добавляет карты к маске уже встреченных карт раздачи, проверяя, что карты не повторяются"""
+    mask = parse_cards(cards)
+    if mask & used or bin(mask).count('1') != len(cards):
+        raise ValueError('Some cards are dealt more than once in hand %s' % hand_id)
+    return used | mask
+
+
+def parse_hand(lines):
+    """Переводит строки раздачи в HandRecord с картами в виде масок (FOLDED или HIDDEN вместо маски,
+    если карты сброшены или не показаны)"""
+    if not lines[0].startswith('Hand '):
+        raise ValueError('Hand must start with a "Hand <id>" line')
+    hand_id = lines[0][len('Hand '):].strip()
+    names, holes, contributions = [], [], []
+    allin_board = None
+    board = 0
+    used = 0
+    for line in lines[1:]:
+        fields = line.split()
+        if fields[0] in ('Allin', 'Board') and len(fields) - 1 > BOARD_SIZE:
+            raise ValueError('More than %d board cards in hand %s' % (BOARD_SIZE, hand_id))
+        if fields[0] == 'Allin':
+            allin_board = parse_cards(fields[1:])
+        elif fields[0] == 'Board':
+            board = parse_cards(fields[1:])
+            used = _check_cards(hand_id, used, fields[1:])
+        elif len(fields) >= 3:
+            names.append(fields[0])
+            if fields[1] in (FOLDED, HIDDEN):
+                holes.append(fields[1])
+            else:
+                holes.append(parse_cards(fields[1:-1]))
+                used = _check_cards(hand_id, used, fields[1:-1])
+            contributions.append(int(fields[-1]))
+            if contributions[-1] < 0:
+                raise ValueError('Negative contribution in hand %s' % hand_id)
+        else:
+            raise ValueError('Wrong line in hand %s: %s' % (hand_id, line))
+    if len(set(names)) != len(names):
+        raise ValueError('Player names repeat in hand %s' % hand_id)
+    in_hand = [hole for hole in holes if hole != FOLDED]
+    if not in_hand:
+        raise ValueError('Everybody folded in hand %s' % hand_id)
+    if HIDDEN in in_hand and len(in_hand) > 1:
+        raise ValueError('Cards of players at showdown must be shown in hand %s' % hand_id)
+    if len(in_hand) > 1 and bin(board).count('1') != BOARD_SIZE:
+        raise ValueError('Showdown needs %d board cards in hand %s' % (BOARD_SIZE, hand_id))
+    if allin_board is not None and allin_board & ~board:
+        raise ValueError('All-in board is not a part of the final board in hand %s' % hand_id)
+    return HandRecord(hand_id, names, holes, contributions, allin_board, board)
+
+
+def allin_ev(record, evaluator=holdem_strength, samples=DEFAULT_SAMPLES, board_size=BOARD_SIZE):
+    """Средний выигрыш каждого игрока в фишках (с учетом вклада) по вариантам доски после олл-ина"""
+    holes = [None if hole in (FOLDED, HIDDEN) else hole for hole in record.holes]
+    known = record.allin_board
+    for hole in holes:
+        known |= hole or 0
+    deck = [card for card in range(len(CARDS)) if not known >> card & 1]
+    missing = board_size - bin(record.allin_board).count('1')
+    if missing <= MAX_EXACT_MISSING:
+        runouts = combinations(deck, missing)
+    else:
+        rnd = random.Random(record.hand_id)
+        runouts = (rnd.sample(deck, missing) for _ in range(samples))
+    pots = build_pots(record.contributions, [i for i, hole in enumerate(holes) if hole is not None])
+    totals = [0] * len(holes)
+    count = 0
+    for runout in runouts:
+        board = record.allin_board
+        for card in runout:
+            board |= 1 << card
+        strengths = [None if hole is None else evaluator(hole, board) for hole in holes]
+        for i, payout in enumerate(award_pots(strengths, pots)[1]):
+            totals[i] += payout
+        count += 1
+    return [total / count - contribution for total, contribution in zip(totals, record.contributions)]
+
+
+class ReplayStats(object):
+    """Сводная статистика по игрокам: {имя: список значений полей STATS_FIELDS} и число ошибочных раздач"""
+
+    def __init__(self):
+        self.players = {}
+        self.hands = 0
+        self.errors = 0
+
+    def _player(self, name):
+        if name not in self.players:
+            self.players[name] = [0] * len(STATS_FIELDS)
+        return self.players[name]
+
+    def add_hand(self, record, evaluator=holdem_strength, samples=DEFAULT_SAMPLES):
+        in_hand = [i for i, hole in enumerate(record.holes) if hole != FOLDED]
+        if len(in_hand) == 1:
+            payouts = [0] * len(record.holes)
+            payouts[in_hand[0]] = sum(record.contributions)
+        else:
+            payouts = resolve_masks([None if hole == FOLDED else hole for hole in record.holes], record.board,
+                                    record.contributions, evaluator).payouts
+        evs = allin_ev(record, evaluator, samples) if record.allin_board is not None and len(in_hand) > 1 else None
+        self.hands += 1
+        for i, name in enumerate(record.names):
+            stats = self._player(name)
+            net = payouts[i] - record.contributions[i]
+            stats[0] += 1
+            stats[1] += len(in_hand) > 1 and i in in_hand
+            stats[2] += payouts[i] > 0
+            stats[3] += net
+            if evs is not None and i in in_hand:
+                stats[4] += 1
+                stats[5] += evs[i]
+                stats[6] += net
+
+    def merge(self, other):
+        self.hands += other.hands
+        self.errors += other.errors
+        for name, values in other.players.items():
+            stats = self._player(name)
+            for i, value in enumerate(values):
+                stats[i] += value
+
+    def result(self):
+        """{имя игрока: PlayerStats}"""
+        return {name: PlayerStats(*values) for name, values in self.players.items()}
+
+
+def replay_chunk(task):
+    """Разбирает и оценивает порцию раздач. Выполняется в процессе пула"""
+    hands, evaluator, samples = task
+    stats = ReplayStats()
+    for lines in hands:
+        # Статистика раздачи добавляется только после оценки, поэтому ошибка не оставляет ее наполовину учтенной
+        try:
+            stats.add_hand(parse_hand(lines), evaluator, samples)
+        except (KeyError, ValueError, IndexError) as e:
+            logging.warning('Skipping hand %s: %s', lines[0], e)
+            stats.errors += 1
+    return stats
+
+
+def replay(files, processes=None, chunk_size=DEFAULT_CHUNK_SIZE, samples=DEFAULT_SAMPLES, evaluator=holdem_strength):
+    """Статистика игроков по истории раздач из файлов (ReplayStats)"""
+    stats = ReplayStats()
+    for chunk_stats in imap_bounded(replay_chunk, _replay_tasks(files, chunk_size, evaluator, samples), processes):
+        stats.merge(chunk_stats)
+    return stats
+
+
+def _replay_tasks(files, chunk_size, evaluator, samples):
+    hands = read_hands(files)
+    while True:
+        chunk = list(islice(hands, chunk_size))
+        if not chunk:
+            return
+        yield chunk, evaluator, samples
+
+
+def format_stats(stats):
+    lines = ['%-16s %8s %9s %6s %10s %7s %11s %11s %10s' % ('player', 'hands', 'showdowns', 'won', 'net', 'allins',
+                                                          'allin EV', 'allin net', 'luck')]
+    for name, player in sorted(stats.result().items(), key=lambda item: -item[1].net):
+        lines.append('%-16s %8d %9d %6d %10d %7d %11.1f %11d %10.1f' % (
+            name, player.hands, player.showdowns, player.won, player.net, player.allins, player.allin_ev,
+            player.allin_net, player.allin_net - player.allin_ev))
+    lines.append('%d hands replayed, %d skipped' % (stats.hands, stats.errors))
+    return '\n'.join(lines)
+
+
+def main(args=None, output=None):
+    options, paths = get_options(args)
+    stats = replay(open_inputs(paths), options.processes, options.chunk_size, options.samples)
+    (output or sys.stdout).write(format_stats(stats) + '\n')
+    return stats.errors
+
+
+def test_replay():
+    print("test_replay...")
+    import io
+    from equity import exact_equity
+    history = """Hand 1
+alice AS AH 100
+bob KC KD 100
+carol - 10
+Allin 2C 7D 9H
+Board 2C 7D 9H JS KS
+
+Hand 2
+alice ? 30
+bob - 10
+Board
+
+Hand 3
+alice 7S 7H 50
+bob AC KC 50
+Allin 7C 8D 2H JD
+Board 7C 8D 2H JD 3S
+Hand 4
+alice AS AS 10
+
+Hand 5
+alice AS AH 10
+bob KC KD 10
+Board 2C 7D
+
+Hand 6
+alice AS AH 10
+bob KC KD 10
+Allin 2C 7D 9H JS 3C 4D
+Board 2C 7D 9H JS 3C 4D
+"""
+    records = [parse_hand(lines) for lines in list(read_hands([io.StringIO(history)]))[:3]]
+    assert [record.hand_id for record in records] == ['1', '2', '3']
+    assert records[0].holes[2] == FOLDED and records[1].holes[0] == HIDDEN and records[1].allin_board is None
+
+    # Сброшенные карты неизвестны, поэтому EV совпадает с эквити игроков, умноженным на банк
+    evs = allin_ev(records[0])
+    equity = exact_equity(["AS AH", "KC KD"], board="2C 7D 9H").players
+    assert [round(ev, 9) for ev in evs] == [round(210 * equity[0].equity - 100, 9),
+                                            round(210 * equity[1].equity - 100, 9), -10]
+    # Терн: тузу с королем одной картой сет семерок не обыграть
+    assert allin_ev(records[2]) == [50, -50]
+
+    for processes in (1, 2):
+        stats = replay([io.StringIO(history)], processes=processes, chunk_size=2)
+        assert stats.hands == 3 and stats.errors == 3
+        players = stats.result()
+        assert players['alice'] == PlayerStats(3, 2, 2, -100 + 10 + 50, 2, evs[0] + 50, -100 + 50)
+        assert players['bob'].net == 110 - 10 - 50 and players['carol'].net == -10
+    assert 'luck' in format_stats(stats)
+    for lines in list(read_hands([io.StringIO(history)]))[4:]:
+        try:
+            parse_hand(lines)
+        except ValueError:
+            pass
+        else:
+            assert False, 'Wrong board parsed without errors: %s' % lines[0]
+    # Ошибка при оценке раздачи пропускает только эту раздачу
+    def broken_evaluator(hole, board):
+        raise KeyError(board)
+    broken = replay_chunk((list(read_hands([io.StringIO(history)]))[:3], broken_evaluator, 10))
+    assert broken.hands == 1 and broken.errors == 2
+    print('OK')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--test':
+        test_replay()
+    else:
+        logging.basicConfig(format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
+        sys.exit(1 if main() else 0)
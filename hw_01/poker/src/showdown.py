@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Вскрытие карт (showdown) нескольких игроков за один вызов.
+# Руки сравниваются по целочисленной силе (как poker.evaluate_mask), без кортежей hand_rank.
+# Если известны вклады игроков в банк, банк делится на основной и побочные банки,
+# каждый банк делится между сильнейшими из претендующих на него игроков,
+# неделимые фишки отдаются победителям по порядку мест, начиная с first_seat.
+# Для вариантов хай-лоу (variants.omaha8_strength) каждый банк делится пополам
+# между старшей и младшей рукой, нечетная фишка достается старшей руке.
+# -----------------
+from collections import namedtuple
+
+from equity import holdem_strength, parse_cards
+
+Showdown = namedtuple('Showdown', 'strengths winners pots payouts')
+Pot = namedtuple('Pot', 'amount players winners payouts')
+
+
+def parse_players(players, board):
+    """Переводит карты игроков и общие карты в маски, проверяя, что ни одна карта не встречается дважды.
+    У сбросивших карты игроков (None вместо карт) маска - None"""
+    board_mask = parse_cards(board)
+    used = board_mask
+    hole_masks = []
+    for cards in players:
+        if cards is None:
+            hole_masks.append(None)
+            continue
+        hole_mask = parse_cards(cards)
+        if hole_mask & used:
+            raise ValueError('Some cards are dealt more than once')
+        used |= hole_mask
+        hole_masks.append(hole_mask)
+    return hole_masks, board_mask
+
+
+def best_players(strengths, players):
+    """Номера игроков из players с сильнейшей рукой"""
+    best = max(strengths[i] for i in players)
+    return [i for i in players if strengths[i] == best]
+
+
+def _split(amount, winners, first_seat, seats):
+    """Делит amount фишек поровну между winners, остаток - по одной фишке по порядку мест от first_seat"""
+    share, odd = divmod(amount, len(winners))
+    payouts = {i: share for i in winners}
+    for i in sorted(winners, key=lambda i: (i - first_seat) % seats)[:odd]:
+        payouts[i] += 1
+    return payouts
+
+
+def _award(amount, players, strengths, first_seat):
+    """Выплаты одного банка игрокам: по старшим рукам или пополам по старшим и младшим"""
+    seats = len(strengths)
+    if not isinstance(strengths[players[0]], tuple):
+        return _split(amount, best_players(strengths, players), first_seat, seats)
+    high = best_players([strength and strength[0] for strength in strengths], players)
+    lows = [strength and strength[1] for strength in strengths]
+    if not max(lows[i] for i in players):
+        return _split(amount, high, first_seat, seats)
+    payouts = _split(amount - amount // 2, high, first_seat, seats)
+    for i, chips in _split(amount // 2, best_players(lows, players), first_seat, seats).items():
+        payouts[i] = payouts.get(i, 0) + chips
+    return payouts
+
+
+def build_pots(contributions, active):
+    """Делит вклады игроков на основной и побочные банки.
+    Возвращает список пар (размер банка, номера претендующих на него игроков из active).
+    Претенденты каждого следующего уровня входят в претендентов предыдущего, поэтому фишки уровней,
+    на которые не претендует никто из active, добавляются к последнему банку. Если никто из active
+    ничего не вложил, банков с претендентами нет, и фишки возвращаются вложившим их игрокам банками из одного игрока"""
+    if not any(contributions[i] > 0 for i in active):
+        return [(chips, [i]) for i, chips in enumerate(contributions) if chips > 0]
+    pots = []
+    previous = 0
+    for level in sorted(set(contribution for contribution in contributions if contribution > 0)):
+        amount = sum(min(contribution, level) - min(contribution, previous) for contribution in contributions)
+        players = [i for i in active if contributions[i] >= level]
+        previous = level
+        if pots and (not players or pots[-1][1] == players):
+            # Фишки, на которые не претендует никто из оставшихся игроков, или банк с теми же претендентами
+            pots[-1] = (pots[-1][0] + amount, pots[-1][1])
+        else:
+            pots.append((amount, players))
+    return pots
+
+
+def award_pots(strengths, pots, first_seat=0):
+    """Делит банки build_pots по силам рук. Возвращает (список Pot, итоговые выплаты игрокам).
+    Банки не зависят от карт, поэтому при переборе вариантов доски их можно построить один раз"""
+    payouts = [0] * len(strengths)
+    result = []
+    for amount, pot_players in pots:
+        pot_payouts = _award(amount, pot_players, strengths, first_seat)
+        for i, chips in pot_payouts.items():
+            payouts[i] += chips
+        result.append(Pot(amount, pot_players, sorted(pot_payouts), pot_payouts))
+    return result, payouts
+
+
+def resolve_masks(hole_masks, board_mask, contributions=None, evaluator=holdem_strength, first_seat=0):
+    """resolve_showdown для карт, заданных масками (None для сбросивших карты игроков).
+    Карты не проверяются на повторы"""
+    strengths = [None if hole_mask is None else evaluator(hole_mask, board_mask) for hole_mask in hole_masks]
+    active = [i for i, strength in enumerate(strengths) if strength is not None]
+    if not active:
+        raise ValueError('At least one player must show cards')
+    if contributions is None:
+        pots = [(len(hole_masks), active)]
+    elif len(contributions) != len(hole_masks) or min(contributions) < 0:
+        raise ValueError('Contributions must be non-negative and given for each player')
+    else:
+        pots = build_pots(contributions, active)
+    result, payouts = award_pots(strengths, pots, first_seat)
+    contested = [pot for pot in result if strengths[pot.players[0]] is not None]
+    winners = contested[0].winners if contested else best_players(strengths, active)
+    return Showdown(strengths, winners, result, payouts)
+
+
+def resolve_showdown(players, board, contributions=None, evaluator=holdem_strength, first_seat=0):
+    """Вскрытие карт: players - карманные карты игроков (None для сбросивших карты), board - общие карты,
+    contributions - вклады игроков в банк (по умолчанию по одной фишке от каждого игрока).
+    Возвращает Showdown: силы рук, номера победителей основного банка, банки с претендентами,
+    победителями и выплатами, итоговые выплаты игрокам"""
+    hole_masks, board_mask = parse_players(players, board)
+    return resolve_masks(hole_masks, board_mask, contributions, evaluator, first_seat)
+
+
+def test_resolve_showdown():
+    print("test_resolve_showdown...")
+    result = resolve_showdown(["AS AH", "KC KD", "QS QH"], "2C 7D 9H KS 3C")
+    assert result.winners == [1] and result.payouts == [0, 3, 0]
+    assert result.strengths[1] > result.strengths[0] > result.strengths[2]
+    board = "2C 7D 9H JS 3C"
+
+    # Ничья: у обоих стрит с доски, третий игрок сбросил карты
+    result = resolve_showdown(["2S 2H", "3S 3H", None], "5C 6D 7H 8S 9C", contributions=[10, 10, 5], first_seat=1)
+    assert result.winners == [0, 1] and result.payouts == [12, 13, 0]
+
+    # Побочные банки: короткий стек с сильнейшей рукой выигрывает только основной банк
+    result = resolve_showdown(["AS AH", "KC KD", "QS QH"], board, contributions=[20, 100, 100])
+    assert [(pot.amount, pot.players, pot.winners) for pot in result.pots] == [(60, [0, 1, 2], [0]),
+                                                                               (160, [1, 2], [1])]
+    assert result.payouts == [60, 160, 0]
+    result = resolve_showdown(["AS AH", "KC KD", None], board, contributions=[20, 50, 100])
+    assert result.payouts == [60, 110, 0]
+
+    # Хай-лоу: старшую руку забирает первый игрок, младшую - второй
+    from variants import omaha8_strength
+    result = resolve_showdown(["KS KD QS QD", "AH 2H 9C 9D"], "KC 3C 4D 8H JS", contributions=[51, 51],
+                              evaluator=omaha8_strength)
+    assert result.payouts == [51, 51]
+    try:
+        resolve_showdown(["AS AH", "AS KD"], board)
+    except ValueError:
+        pass
+    else:
+        assert False, 'Duplicate cards resolved without errors'
+    # Фишки уровня, на который не претендует никто из вскрывшихся, идут в следующий банк или возвращаются
+    result = resolve_showdown(["AS AH", None], board, contributions=[0, 10])
+    assert result.winners == [0] and result.payouts == [0, 10]
+    result = resolve_showdown(["AS AH", "KC KD", None], board, contributions=[20, 20, 10])
+    assert [(pot.amount, pot.players) for pot in result.pots] == [(50, [0, 1])] and result.payouts == [50, 0, 0]
+    result = resolve_showdown(["AS AH", "KC KD", None, None], board, contributions=[0, 0, 10, 5])
+    assert result.payouts == [0, 0, 10, 5]
+    hole_masks, board_mask = parse_players(["AS AH", "KC KD", None], board)
+    assert resolve_masks(hole_masks, board_mask).payouts == [3, 0, 0]
+    print('OK')
+
+
+if __name__ == '__main__':
+    test_resolve_showdown()
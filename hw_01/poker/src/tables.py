@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Генерация файла таблиц оценки рук для poker.py.
+# Таблицы строятся один раз и записываются в двоичный файл с версией формата,
+# при импорте poker.py отображает его в память вместо построения таблиц заново.
+# При изменении формата или алгоритма построения таблиц нужно увеличить
+# poker.TABLES_VERSION - файлы старой версии будут проигнорированы.
+#
+# Перед записью таблицы замен джокеров сверяются с полным перебором на --verify случайных руках.
+#
+# Запуск: python3 tables.py [--verify N] [путь к файлу, по умолчанию poker.TABLES_PATH]
+# -----------------
+import optparse
+import os
+import random
+import sys
+from array import array
+
+import poker
+from poker import (CARDS, RANK_MASK, TABLE_JOKERS, TABLES_HEADER, TABLES_MAGIC, TABLES_PATH,
+                   TABLES_RANK_RECORD, TABLES_VERSION, _build_straight_table, _build_tables, _build_wild_tables,
+                   best_wild_hand, hand_strength, load_tables, reference_best_wild_hand)
+
+DEFAULT_VERIFY_SAMPLES = 300
+# Наборы джокеров для проверки таблиц замен
+VERIFY_JOKERS = [['?B'], ['?R'], ['?B', '?R'], ['?R', '?R'], ['?B', '?B']]
+
+
+def get_options(args=None):
+    parser = optparse.OptionParser('usage: %prog [--verify N] [path]')
+    parser.add_option('--verify', dest='verify', type='int', default=DEFAULT_VERIFY_SAMPLES,
+                      help='random hands with jokers checked against brute force before the file is written')
+    (options, args) = parser.parse_args(args)
+    if len(args) > 1:
+        parser.error('only one path can be given')
+    return options, args[0] if args else TABLES_PATH
+
+
+def tables_bytes(wild_tables=None):
+    """Строит таблицы и возвращает содержимое файла таблиц.
+    wild_tables - уже построенные _build_wild_tables таблицы замен джокеров"""
+    prime_table, flush_table, _, representatives = _build_tables()
+    wild_ranks, wild_fill = wild_tables or _build_wild_tables()
+    keys = sorted(prime_table)
+    wild_keys = [sorted(wild_ranks[jokers]) for jokers in TABLE_JOKERS]
+    records = bytearray()
+    for ranks, is_flush in representatives[1:]:
+        records.append(is_flush)
+        records.extend(ranks)
+    sections = [array('I', keys)]
+    sections.extend(array('I', jokers_keys) for jokers_keys in wild_keys)
+    sections.extend([
+        array('H', flush_table),
+        array('H', _build_straight_table()),
+        array('H', [prime_table[key] for key in keys]),
+    ])
+    sections.extend(array('H', wild_fill[jokers]) for jokers in TABLE_JOKERS)
+    if sys.byteorder != 'little':
+        for section in sections:
+            section.byteswap()
+    sections.append(records)
+    sections.extend(bytes(wild_ranks[jokers][key] for key in jokers_keys)
+                    for jokers, jokers_keys in zip(TABLE_JOKERS, wild_keys))
+    header = TABLES_HEADER.pack(TABLES_MAGIC, TABLES_VERSION, RANK_MASK + 1, len(keys),
+                                len(records) // TABLES_RANK_RECORD, *(len(jokers_keys) for jokers_keys in wild_keys))
+    return header + b''.join(bytes(section) for section in sections)
+
+
+def verify_wild_tables(wild_ranks, wild_fill, samples=DEFAULT_VERIFY_SAMPLES, seed=0):
+    """Сверяет best_wild_hand по таблицам замен с полным перебором reference_best_wild_hand
+    на случайных руках из 5-7 карт. Возвращает список рук, на которых результаты расходятся"""
+    rnd = random.Random(seed)
+    saved = poker.WILD_RANKS, poker.WILD_FLUSH_FILL
+    poker.WILD_RANKS, poker.WILD_FLUSH_FILL = wild_ranks, wild_fill
+    try:
+        mismatches = []
+        for i in range(samples):
+            jokers = VERIFY_JOKERS[i % len(VERIFY_JOKERS)]
+            hand = rnd.sample(CARDS, rnd.randint(5, 7) - len(jokers)) + jokers
+            if hand_strength(best_wild_hand(hand)) != hand_strength(reference_best_wild_hand(hand)):
+                mismatches.append(hand)
+        return mismatches
+    finally:
+        poker.WILD_RANKS, poker.WILD_FLUSH_FILL = saved
+
+
+def generate_tables(path=TABLES_PATH, verify=DEFAULT_VERIFY_SAMPLES):
+    """Строит таблицы, проверяет таблицы замен джокеров на verify случайных руках и записывает файл таблиц.
+    Файл сначала пишется во временный и затем переименовывается, чтобы процессы,
+    уже отобразившие старый файл в память, продолжали с ним работать"""
+    wild_tables = _build_wild_tables()
+    mismatches = verify_wild_tables(*wild_tables, samples=verify)
+    if mismatches:
+        raise ValueError('Joker tables differ from brute force on %s' % ', '.join(' '.join(h) for h in mismatches[:5]))
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        f.write(tables_bytes(wild_tables))
+    os.replace(temp_path, path)
+
+
+def test_tables():
+    print("test_tables...")
+    import tempfile
+    prime_table, flush_table, hand_ranks, _ = _build_tables()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'tables.bin')
+        assert load_tables(path) is None
+        generate_tables(path, verify=50)
+        loaded_primes, loaded_flush, loaded_straight, loaded_ranks, wild_ranks, wild_fill = load_tables(path)
+        assert loaded_primes == prime_table
+        assert list(loaded_flush) == flush_table
+        assert list(loaded_straight) == _build_straight_table()
+        assert len(loaded_ranks) == len(hand_ranks) and loaded_ranks[1:] == hand_ranks[1:]
+        assert loaded_ranks[0] is None and loaded_ranks[-1] == hand_ranks[-1]
+        built_ranks, built_fill = _build_wild_tables()
+        assert wild_ranks == built_ranks and {jokers: list(fill) for jokers, fill in wild_fill.items()} == built_fill
+        assert not verify_wild_tables(wild_ranks, wild_fill, samples=500, seed=1)
+        # Руки, для которых в таблицах нет замен, оцениваются перебором кандидатов
+        assert not verify_wild_tables({1: {}, 2: {}}, wild_fill, samples=20, seed=2)
+        # Файл другой версии или обрезанный файл не загружается
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(TABLES_HEADER.pack(TABLES_MAGIC, TABLES_VERSION + 1, *TABLES_HEADER.unpack_from(data)[2:]) +
+                    data[TABLES_HEADER.size:])
+        assert load_tables(path) is None
+        with open(path, 'wb') as f:
+            f.write(data[:-1])
+        assert load_tables(path) is None
+    print('OK')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--test':
+        test_tables()
+    else:
+        options, path = get_options()
+        generate_tables(path, options.verify)
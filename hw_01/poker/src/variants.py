@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Оценка рук в других вариантах покера на общем ядре poker.py.
+# Омаха: у игрока 4 карманные карты, рука составляется ровно из 2х карманных и 3х общих.
+# Омаха хай-лоу (Омаха-8): банк делится между старшей и младшей рукой, младшая рука -
+# пять разных рангов не старше восьмерки (туз считается младшей картой).
+# Короткая колода (шорт-дек): в колоде 36 карт от шестерок до тузов, младший стрит
+# A-6-7-8-9, флеш старше фулл-хауса, тройка старше стрита (правила Triton).
+# Все функции силы принимают маски карманных и общих карт, как equity.holdem_strength,
+# и могут передаваться в функции модуля equity как evaluator.
+# -----------------
+from functools import lru_cache
+from itertools import combinations
+
+from equity import exact_equity, monte_carlo_equity
+from poker import (CARDS, CARD_PRIMES, CARD_RANK_BITS, CARD_SUITS, FLUSH_STRENGTH, POPCOUNT, PRIME_PRODUCT_STRENGTH,
+                   RANKS, _bits, _build_straight_table, _top_bit, _top_bits, rank_groups, strength5)
+
+CACHE_SIZE = 4096
+
+# Биты младших рангов для Омахи-8: туз - бит 0, двойка - бит 1, ..., восьмерка - бит 7
+LOW_RANK_BITS = [1 if rank == len(RANKS) - 1 else 1 << (rank + 1) if rank < 7 else 0
+                 for rank in (card % len(RANKS) for card in range(len(CARDS)))]
+LOW_BASE = 1 << 8
+
+SHORT_DECK_RANKS = RANKS[RANKS.index('6'):]
+SHORT_DECK_REMOVED = [card for card in CARDS if card[0] not in SHORT_DECK_RANKS]
+SHORT_DECK_STRAIGHTS = [0b11111 << low for low in range(len(RANKS) - 5, RANKS.index('6') - 1, -1)] + \
+    [(1 << RANKS.index('A')) | (0b1111 << RANKS.index('6'))]
+SHORT_DECK_STRAIGHT_MASK = _build_straight_table(SHORT_DECK_STRAIGHTS)
+# Категории шорт-дека по возрастанию силы
+(SD_HIGH_CARD, SD_PAIR, SD_TWO_PAIR, SD_STRAIGHT, SD_TRIPS, SD_FULL_HOUSE, SD_FLUSH, SD_QUADS,
+ SD_STRAIGHT_FLUSH) = range(9)
+
+
+def _cards(mask):
+    return [bit.bit_length() - 1 for bit in _bits(mask)]
+
+
+def _parts(cards, n):
+    """Для каждого сочетания n карт - (произведение простых чисел рангов, масть или -1, маска рангов)"""
+    parts = []
+    for chosen in combinations(cards, n):
+        product = 1
+        rank_bits = 0
+        for card in chosen:
+            product *= CARD_PRIMES[card]
+            rank_bits |= CARD_RANK_BITS[card]
+        suit = CARD_SUITS[chosen[0]]
+        parts.append((product, suit if all(CARD_SUITS[card] == suit for card in chosen) else -1, rank_bits))
+    return tuple(parts)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _hole_parts(hole_mask):
+    return _parts(_cards(hole_mask), 2)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _board_parts(board_mask):
+    return _parts(_cards(board_mask), 3)
+
+
+def omaha_strength(hole_mask, board_mask):
+    """Сила лучшей руки Омахи: ровно 2 карманные и 3 общие карты.
+    Произведения простых чисел и масти пар карманных и троек общих карт считаются
+    один раз на руку и на борд, каждое из 60 сочетаний - одно умножение и один поиск в таблице"""
+    best = 0
+    for hole_product, hole_suit, hole_bits in _hole_parts(hole_mask):
+        for board_product, board_suit, board_bits in _board_parts(board_mask):
+            if hole_suit == board_suit >= 0:
+                strength = FLUSH_STRENGTH[hole_bits | board_bits]
+            else:
+                strength = PRIME_PRODUCT_STRENGTH[hole_product * board_product]
+            if strength > best:
+                best = strength
+    return best
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _low_parts(mask, n):
+    """Маски из n разных младших рангов, которые можно составить из карт маски"""
+    low_ranks = 0
+    for card in _cards(mask):
+        low_ranks |= LOW_RANK_BITS[card]
+    return tuple(sum(chosen) for chosen in combinations(_bits(low_ranks), n))
+
+
+def omaha8_low(hole_mask, board_mask):
+    """Сила младшей руки Омахи-8 (чем больше, тем лучше) или 0, если младшей руки нет.
+    Младшие руки сравниваются по старшей карте, поэтому лучшая - с наименьшей маской рангов"""
+    best = LOW_BASE
+    for hole_low in _low_parts(hole_mask, 2):
+        for board_low in _low_parts(board_mask, 3):
+            if not hole_low & board_low and hole_low | board_low < best:
+                best = hole_low | board_low
+    return LOW_BASE - best
+
+
+def omaha8_strength(hole_mask, board_mask):
+    """Сила руки Омахи-8: пара (сила старшей руки, сила младшей руки или 0)"""
+    return omaha_strength(hole_mask, board_mask), omaha8_low(hole_mask, board_mask)
+
+
+def _pack(category, groups):
+    """Сила руки шорт-дека: категория и ранги пяти карт по убыванию значимости, по 4 бита на ранг.
+    Ранги, не влияющие на силу (у стрита важна только старшая карта), заполняются нулями"""
+    strength = category
+    count = 0
+    for group, n in groups:
+        for bit in reversed(_bits(group)):
+            for _ in range(n):
+                strength = strength << 4 | (bit.bit_length() - 1)
+                count += 1
+    return strength << 4 * (5 - count)
+
+
+def _straight_high(straight):
+    """Старшая карта стрита шорт-дека (у A-6-7-8-9 - девятка)"""
+    return _top_bit(straight & ~(1 << RANKS.index('A'))) if straight & (1 << RANKS.index('6')) else _top_bit(straight)
+
+
+def shortdeck_strength(hole_mask, board_mask):
+    """Сила лучшей руки из 5ти карт в шорт-деке (техасский холдем на 36 картах)"""
+    suits, ranks, fours, trips, pairs = rank_groups(hole_mask | board_mask)
+    best = 0
+    for suited in suits:
+        if POPCOUNT[suited] >= 5:
+            straight = SHORT_DECK_STRAIGHT_MASK[suited]
+            if straight:
+                best = max(best, _pack(SD_STRAIGHT_FLUSH, ((_straight_high(straight), 1),)))
+            else:
+                best = max(best, _pack(SD_FLUSH, ((_top_bits(suited, 5), 1),)))
+    if fours:
+        quad = _top_bit(fours)
+        return max(best, _pack(SD_QUADS, ((quad, 4), (_top_bit(ranks ^ quad), 1))))
+    if best:
+        return best
+    if trips and (trips & (trips - 1) or pairs):
+        trip = _top_bit(trips)
+        return _pack(SD_FULL_HOUSE, ((trip, 3), (_top_bit((trips ^ trip) | pairs), 2)))
+    if trips:
+        return _pack(SD_TRIPS, ((trips, 3), (_top_bits(ranks ^ trips, 2), 1)))
+    if SHORT_DECK_STRAIGHT_MASK[ranks]:
+        return _pack(SD_STRAIGHT, ((_straight_high(SHORT_DECK_STRAIGHT_MASK[ranks]), 1),))
+    if pairs & (pairs - 1):
+        pairs = _top_bits(pairs, 2)
+        return _pack(SD_TWO_PAIR, ((pairs, 2), (_top_bit(ranks ^ pairs), 1)))
+    if pairs:
+        return _pack(SD_PAIR, ((pairs, 2), (_top_bits(ranks ^ pairs, 3), 1)))
+    return _pack(SD_HIGH_CARD, ((_top_bits(ranks, 5), 1),))
+
+
+def shortdeck_category(strength):
+    """Категория руки шорт-дека по ее силе"""
+    return strength >> 20
+
+
+def _short_deck_dead(dead):
+    dead = dead.split() if isinstance(dead, str) else list(dead)
+    return dead + [card for card in SHORT_DECK_REMOVED if card not in dead]
+
+
+def omaha_equity(players, board=(), dead=(), exact=False, **kwargs):
+    """Эквити в Омахе: exact - перебор всех раздач, иначе метод Монте-Карло"""
+    equity = exact_equity if exact else monte_carlo_equity
+    return equity(players, board, dead, evaluator=omaha_strength, **kwargs)
+
+
+def omaha8_equity(players, board=(), dead=(), exact=False, **kwargs):
+    """Эквити в Омахе-8: банк делится пополам между старшей и младшей рукой"""
+    equity = exact_equity if exact else monte_carlo_equity
+    return equity(players, board, dead, evaluator=omaha8_strength, **kwargs)
+
+
+def shortdeck_equity(players, board=(), dead=(), exact=False, **kwargs):
+    """Эквити в шорт-деке: карты от двоек до пятерок не участвуют в раздаче"""
+    equity = exact_equity if exact else monte_carlo_equity
+    return equity(players, board, _short_deck_dead(dead), evaluator=shortdeck_strength, **kwargs)
+
+
+def _mask(cards):
+    return sum(1 << CARDS.index(card) for card in cards.split())
+
+
+def _reference_shortdeck5(cards):
+    """Простая оценка руки шорт-дека из 5ти карт для проверки shortdeck_strength"""
+    values = sorted((SHORT_DECK_RANKS.index(card[0]) for card in cards), reverse=True)
+    counts = sorted(((values.count(v), v) for v in set(values)), reverse=True)
+    shape = [count for count, _ in counts]
+    order = [v for count, v in counts for _ in range(count)]
+    is_flush = len(set(card[1] for card in cards)) == 1
+    straight = shape == [1] * 5 and (values[0] - values[4] == 4 or values == [8, 3, 2, 1, 0])
+    if straight and values == [8, 3, 2, 1, 0]:
+        order = [3, 2, 1, 0, -1]
+    category = (SD_STRAIGHT_FLUSH if straight and is_flush else SD_QUADS if shape[0] == 4 else
+                SD_FLUSH if is_flush else SD_FULL_HOUSE if shape[:2] == [3, 2] else SD_TRIPS if shape[0] == 3 else
+                SD_STRAIGHT if straight else SD_TWO_PAIR if shape[:2] == [2, 2] else SD_PAIR if shape[0] == 2 else
+                SD_HIGH_CARD)
+    return (category, order[0]) if category in (SD_STRAIGHT, SD_STRAIGHT_FLUSH) else (category, order)
+
+
+def test_omaha():
+    print("test_omaha...")
+    import random
+    rnd = random.Random(17)
+    for _ in range(300):
+        cards = rnd.sample(range(len(CARDS)), 9)
+        hole, board = cards[:4], cards[4:]
+        expected = max(strength5(list(pair) + list(triple))
+                       for pair in combinations(hole, 2) for triple in combinations(board, 3))
+        assert omaha_strength(sum(1 << c for c in hole), sum(1 << c for c in board)) == expected
+    # Четыре пики на руках и одна на борде - не флеш
+    assert omaha_strength(_mask("AS KS QS JS"), _mask("TS 2D 3C 7H 9H")) == strength5(
+        [CARDS.index(card) for card in "AS KS TS 9H 7H".split()])
+    assert omaha8_low(_mask("AS 2S KD KC"), _mask("3C 4D 5H 9S TS")) == LOW_BASE - 0b11111
+    assert omaha8_low(_mask("AS 2S KD KC"), _mask("3C 4D 9H 9S TS")) == 0
+    assert omaha8_low(_mask("AS AD KD KC"), _mask("3C 4D 5H 6S 7S")) == 0
+    assert omaha8_low(_mask("AS 8D KD KC"), _mask("3C 4D 5H 6S 7S")) == LOW_BASE - 0b10011101
+    # Старшую руку забирает первый игрок, младшую - второй
+    result = omaha8_equity(["KS KD QS QD", "AH 2H 9C 9D"], board="KC 3C 4D 8H JS", exact=True)
+    assert [player.equity for player in result.players] == [0.5, 0.5]
+    result = omaha_equity(["AS AH KS KH", "QC QD JC TD"], board="2S 7D 9H", exact=True)
+    assert result.samples == 820 and result.players[0].equity > 0.5
+    print('OK')
+
+
+def test_shortdeck():
+    print("test_shortdeck...")
+    import random
+    rnd = random.Random(19)
+    deck = [card for card in CARDS if card[0] in SHORT_DECK_RANKS]
+    for _ in range(300):
+        cards = rnd.sample(deck, 7)
+        expected = max(_reference_shortdeck5(five) for five in combinations(cards, 5))
+        strength = shortdeck_strength(_mask(' '.join(cards[:2])), _mask(' '.join(cards[2:])))
+        for other in (rnd.sample(deck, 7) for _ in range(3)):
+            other_expected = max(_reference_shortdeck5(five) for five in combinations(other, 5))
+            other_strength = shortdeck_strength(_mask(' '.join(other[:2])), _mask(' '.join(other[2:])))
+            assert (strength > other_strength) == (expected > other_expected)
+            assert (strength == other_strength) == (expected == other_expected)
+        assert shortdeck_category(strength) == expected[0]
+    assert shortdeck_category(shortdeck_strength(_mask("AS 6D"), _mask("7C 8H 9S KD KC"))) == SD_STRAIGHT
+    assert shortdeck_strength(_mask("TS 6D"), _mask("7C 8H 9S KD KC")) > \
+        shortdeck_strength(_mask("AS 6D"), _mask("7C 8H 9S KD KC"))
+    assert shortdeck_category(shortdeck_strength(_mask("AS 7S"), _mask("9S JS KS KD KC"))) == SD_FLUSH
+    assert shortdeck_category(shortdeck_strength(_mask("6S 7D"), _mask("8C 9H TS TD TC"))) == SD_TRIPS
+    result = shortdeck_equity(["AS AH", "KS KH"], dead="2C", precision=0.02, processes=1)
+    assert 0.7 < result.players[0].equity < 0.85
+    print('OK')
+
+
+if __name__ == '__main__':
+    test_omaha()
+    test_shortdeck()